@@ -1,5 +1,7 @@
+import click
 from dotenv import load_dotenv
-from flask import Flask, jsonify
+from flask import Flask, current_app, jsonify
+from flask.cli import with_appcontext
 from flask_jwt_extended import JWTManager
 from flask_restful import Api
 from marshmallow import ValidationError
@@ -7,91 +9,195 @@ from marshmallow import ValidationError
 from blacklist import BLACKLIST
 from db import db
 from ma import ma
-from models.event import EventModel
+from models.counter import CounterModel
 from models.reservation import ReservationModel
-from resources.event import Event, EventList
-from resources.reservation import Reservation
-from resources.statistics import Statistics
-from resources.user import UserRegister, User, UserLogin, UserLogout
-from utils.conts import ticket_numbers
+from models.reservation_rollup import ReservationRollupModel
+from models.ticket import TicketModel
+from resources.event import Event, EventImport, EventList, EventStream
+from resources.metrics import Metrics
+from resources.payment import Payment
+from resources.reservation import GroupReservation, Reservation
+from resources.statistics import Statistics, StatisticsTimeseries
+from resources.user import UserRegister, User, UserLogin, UserLogout, UserReservations
+from utils import unit_of_work
+from utils.admission import admission_gate
+from utils.archiver import reservation_archiver
+from utils.cache import cache
+from utils.conts import ticket_types
+from utils.background import background
+from utils.event_import import FORMATS, import_events
+from utils.live import live_hub
+from utils.metrics import metrics
+from utils.password_manager import password_hasher
+from utils.payments import payment_processor
+from utils.reconcile import reconcile_inventory
+from utils.schema import upgrade_schema
+from utils.representations import json_representation
 
 load_dotenv(".env", verbose=True)
 
 
-app = Flask(__name__)
-app.config.from_object("config")  # load default configs from config.py
-app.config.from_envvar(
-    "APPLICATION_SETTINGS"
-)  # override with config.py (APPLICATION_SETTINGS points to config.py)
-api = Api(app)
-
-
-@app.before_first_request
-def create_tables():
+# Application factory, settings override the configuration (e.g. for benchmarks). Nothing is started here, the
+# background work is started separately once the serving process exists (see wsgi.py)
+def create_app(settings: dict = None) -> Flask:
+    app = Flask(__name__)
+    app.config.from_object("config")  # load default configs from config.py
+    app.config.from_envvar(
+        "APPLICATION_SETTINGS", silent=bool(settings)
+    )  # override with config.py (APPLICATION_SETTINGS points to config.py)
+    app.config.update(settings or {})
+    api = Api(app)
+    json_representation.init_app(app, api)
+    db.init_app(app)
+    ma.init_app(app)
+    BLACKLIST.init_app(app)
+    password_hasher.init_app(app)
+    payment_processor.init_app(app)
+    admission_gate.init_app(app)
+    cache.init_app(app)
+    live_hub.init_app(app)
+    background.init_app(app)
+    if app.config["METRICS_ENABLED"]:
+        metrics.init_app(app)
+    # registered after the metrics, so its commit is counted in the same request
+    unit_of_work.init_app(app, db.session)
+
+    app.register_error_handler(ValidationError, handle_marshmallow_validation)
+
+    # New JWT manager, for authentication purposes
+    jwt = JWTManager(app)
+    jwt.token_in_blacklist_loader(check_if_token_in_blacklist)
+
+    for command in (upgrade_db, reconcile, rebuild_counters, import_events_command, shard_inventory,
+                    archive_reservations):
+        app.cli.add_command(command)
+
+    api.add_resource(Reservation, "/reservation", "/reservation/<string:reservation_id>")
+    api.add_resource(GroupReservation, "/reservations")
+    api.add_resource(Payment, "/payment/<string:payment_id>")
+    api.add_resource(EventList, "/events")
+    api.add_resource(EventImport, "/events/import")
+    api.add_resource(Event, "/event", "/event/id/<int:_id>", "/event/name/<string:name>")
+    api.add_resource(EventStream, "/event/id/<int:_id>/stream")
+    api.add_resource(UserRegister, "/register")
+    api.add_resource(User, "/user/<int:user_id>")
+    api.add_resource(UserReservations, "/user/<int:user_id>/reservations")
+    api.add_resource(UserLogin, "/login")
+    api.add_resource(UserLogout, "/logout")
+    api.add_resource(Statistics, "/statistics/event/<int:event_id>", "/statistics/tickets/<string:ticket_type>",
+                     "/statistics/events", "/statistics/tickets/<string:ticket_type>")
+    api.add_resource(StatisticsTimeseries, "/statistics/event/<int:event_id>/timeseries")
+    if app.config["METRICS_ENABLED"]:
+        api.add_resource(Metrics, "/metrics")
+    return app
+
+
+# Creates the tables and brings the ticket pools back in line with the reservations, it has to run once before the app
+# starts serving requests, never from several processes at once (see the reconcile command)
+def setup_database():
     db.create_all()
-    check_startup_expired()
-    fix_ticket_availability()
-
-
-# If the app crashes, there is a need to update fields related to the expiration of the reservations
-# Not the perfect solution using in the decorator before first request, needs better implementation
-def check_startup_expired():
-    expired_reservations = list(filter(lambda x: x.expired
-                                       and x.remaining_time != "Expired"
-                                       and not x.paid,
-                                       ReservationModel.query.all()))
-    list(map(lambda x: setattr(x, 'remaining_time', "Expired"),
-             expired_reservations))
-
-    def save_to_db(reservation):
-        db.session.add(reservation)
-        db.session.commit()
+    result = reconcile_inventory(current_app.config["EXPIRY_SWEEP_BATCH_SIZE"])
+    current_app.logger.info("Reconciliation released %s expired reservations and fixed %s ticket pools in %.3fs",
+                            result["expired"], result["tickets"], result["seconds"])
+    return result
 
-    list(map(lambda x: save_to_db(x),
-             expired_reservations))
 
-
-# Fixing availability of the tickets here
-def fix_ticket_availability():
-    events = EventModel.query.all()
-    for event in events:
-        for ticket_model in event.tickets:
-            ticket_model.number_available = ticket_numbers[ticket_model.ticket_type]
-    reservations = ReservationModel.query.all()
-    for reservation in reservations:
-        if reservation.paid or not reservation.expired:
-            reservation.update_event()
-
-
-@app.errorhandler(ValidationError)
 def handle_marshmallow_validation(err):
     return jsonify(err.messages), 400
 
 
-# New JWT manager, for authentication purposes
-jwt = JWTManager(app)
-
-
 # This method will check if a token is blacklisted, and will be called automatically when blacklist is enabled
-@jwt.token_in_blacklist_loader
 def check_if_token_in_blacklist(decrypted_token):
     return decrypted_token["jti"] in BLACKLIST
 
 
-api.add_resource(Reservation, "/reservation", "/reservation/<string:reservation_id>")
-api.add_resource(EventList, "/events")
-api.add_resource(Event, "/event", "/event/id/<int:_id>", "/event/name/<string:name>")
-api.add_resource(UserRegister, "/register")
-api.add_resource(User, "/user/<int:user_id>")
-api.add_resource(UserLogin, "/login")
-api.add_resource(UserLogout, "/logout")
-api.add_resource(Statistics, "/statistics/event/<int:event_id>", "/statistics/tickets/<string:ticket_type>",
-                 "/statistics/events", "/statistics/tickets/<string:ticket_type>")
+# Brings a database created by an earlier version up to the models (see utils.schema), run before the reconcile
+# command when deploying a new version
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db():
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo("Dropped {}.".format(change[1:]) if change.startswith("-") else "Added {}.".format(change))
+    click.echo("The schema is up to date ({} changes).".format(len(changes)))
+    # the events created before the counters existed have none yet
+    drift = rebuild_all_counters(fix=True)
+    click.echo("{} counters rebuilt.".format(len(drift)))
+
+
+@click.command("reconcile")
+@with_appcontext
+def reconcile():
+    result = setup_database()
+    click.echo("Released {expired} expired reservations and fixed {tickets} ticket pools in {seconds:.3f}s."
+               .format(**result))
+
+
+# Recomputes the statistics counters from the raw reservations and the rollups of the archived ones, returns the drift
+# found (see CounterModel.rebuild)
+def rebuild_all_counters(fix: bool) -> list:
+    pools = db.session.query(TicketModel.event_id, TicketModel.ticket_type).all()
+    aggregated = ReservationModel.aggregate_counts() + ReservationRollupModel.aggregate_counts()
+    return CounterModel.rebuild(aggregated, pools, fix=fix)
+
+
+# e.g. flask rebuild-counters --verify
+@click.command("rebuild-counters")
+@click.option("--verify", is_flag=True, help="Only report the drift, without fixing the counters.")
+@with_appcontext
+def rebuild_counters(verify):
+    drift = rebuild_all_counters(fix=not verify)
+    for entry in drift:
+        click.echo("event {event_id} {ticket_type}: stored {stored}, expected {expected}".format(**entry))
+    click.echo("{} counters drifted{}.".format(len(drift), "" if verify or not drift else ", fixed"))
+
+
+# Imports the events of a JSONL or CSV file, e.g. flask import-events season.csv --format csv
+@click.command("import-events")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(FORMATS), default="jsonl")
+@click.option("--chunk-size", type=int, default=None, help="Events committed at once.")
+@with_appcontext
+def import_events_command(path, file_format, chunk_size):
+    with open(path, "rb") as stream:
+        report = import_events(stream, file_format, chunk_size or current_app.config["EVENT_IMPORT_CHUNK_SIZE"],
+                               current_app.config["EVENT_IMPORT_MAX_ERRORS"], current_app.config["INVENTORY_SHARDS"])
+    for error in report["errors"]:
+        click.echo("line {line}: {errors}".format(**error))
+    click.echo("Imported {imported} events, {failed} rows failed.".format(**report))
+
+
+# Splits the ticket pools of an event across shards (1 merges them back), e.g. flask shard-inventory 1 --shards 8
+@click.command("shard-inventory")
+@click.argument("event_id", type=int)
+@click.option("--shards", type=click.IntRange(min=1), required=True)
+@click.option("--ticket-type", type=click.Choice(ticket_types), default=None, help="Only this pool.")
+@with_appcontext
+def shard_inventory(event_id, shards, ticket_type):
+    for pool_type in [ticket_type] if ticket_type else ticket_types:
+        ticket = TicketModel.shard(event_id, pool_type, shards)
+        if ticket is None:
+            raise click.ClickException("Event {} has no {} tickets.".format(event_id, pool_type))
+        click.echo("{}: {} tickets in {} shards.".format(pool_type, ticket.available, max(ticket.shard_count, 1)))
+    db.session.commit()
+
+
+# Moves the reservations that can not change anymore to the archive now instead of waiting for the background job,
+# e.g. flask archive-reservations --max-batches 100
+@click.command("archive-reservations")
+@click.option("--max-batches", type=click.IntRange(min=1), default=None, help="Batches archived at most.")
+@with_appcontext
+def archive_reservations(max_batches):
+    config = current_app.config
+    archived = reservation_archiver.archive(config["ARCHIVE_BATCH_SIZE"], max_batches or config["ARCHIVE_MAX_BATCHES"],
+                                            config["ARCHIVE_EXPIRED_AFTER"], config["ARCHIVE_PAST_EVENTS_AFTER"])
+    click.echo("Archived {} reservations in {:.3f}s.".format(archived, reservation_archiver.stats.last_duration))
 
 
 if __name__ == "__main__":
-    db.init_app(app)
-    db.app = app
-    ma.init_app(app)
+    app = create_app()
+    with app.app_context():
+        setup_database()
+    background.start()
     # Start Flask APP
     app.run(host='0.0.0.0', port=5000, use_reloader=False)
@@ -0,0 +1,52 @@
+"""
+Commit budget of the handlers.
+
+Every handler runs once through the test client and the X-DB-Commits header (METRICS_HEADERS) is compared with its
+budget: exactly one commit for the requests that change data and none for the read only ones.
+
+    python -m benchmarks.commit_count
+"""
+from benchmarks.common import load_app
+
+
+def run() -> list:
+    app = load_app(METRICS_HEADERS=True, PAYMENT_POLL_INTERVAL=3600)
+    client = app.test_client()
+    results = []
+
+    def check(expected, method, url, **kwargs):
+        response = getattr(client, method)(url, **kwargs)
+        commits = int(response.headers["X-DB-Commits"])
+        results.append({"request": "{} {}".format(method.upper(), url), "status": response.status_code,
+                        "commits": commits, "expected": expected})
+        return response
+
+    check(1, "post", "/register", json={"username": "user", "password": "secret"})
+    token = check(1, "post", "/login", json={"username": "user", "password": "secret"}).get_json()["access_token"]
+    headers = {"Authorization": "Bearer " + token}
+    check(1, "post", "/event", json={"name": "Concert", "date": "2030-01-01", "time": "20:00:00"})
+    check(0, "get", "/events")
+    check(0, "get", "/event/id/1")
+    check(1, "post", "/reservation", json={"event_id": 1, "ticket_type": "VIP"}, headers=headers)
+    reservation_ids = check(1, "post", "/reservations", json={"event_id": 1, "tickets": {"VIP": 2}},
+                            headers=headers).get_json()["reservations"]
+    check(0, "get", "/reservation/{}".format(reservation_ids[0]))
+    payment_id = check(1, "post", "/reservation/{}".format(reservation_ids[0]), json={"amount": 10, "token": "ok"},
+                       headers=headers).get_json()["payment_id"]
+    check(0, "get", "/payment/{}".format(payment_id))
+    check(0, "get", "/statistics/events")
+    check(0, "get", "/statistics/event/1")
+    check(0, "get", "/statistics/tickets/vip")
+    check(0, "post", "/reservation", json={"event_id": 99, "ticket_type": "VIP"}, headers=headers)
+    check(1, "post", "/logout", headers=headers)
+    return results
+
+
+if __name__ == "__main__":
+    failures = 0
+    for result in run():
+        ok = result["commits"] == result["expected"]
+        failures += not ok
+        print("{:<4} {:<58} {} commits={} expected={}".format(
+            "ok" if ok else "FAIL", result["request"], result["status"], result["commits"], result["expected"]))
+    assert not failures, "{} handlers did not commit exactly as expected".format(failures)
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+from db import db
+
+
+def database_uri() -> str:
+    uri = os.environ.get("BENCHMARK_DATABASE_URI")
+    if not uri:
+        uri = "sqlite:///{}".format(os.path.join(tempfile.mkdtemp(), "benchmark.db"))
+    return uri
+
+
+# Creates the app against a fresh benchmark database, extra settings override the ones from config.py. The background
+# jobs are not started, benchmarks run them explicitly when they need them
+def load_app(**settings):
+    uri = database_uri()
+    settings.setdefault("SQLALCHEMY_DATABASE_URI", uri)
+    if uri.startswith("sqlite"):
+        # writers wait for the database lock instead of failing straight away
+        settings.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {"connect_args": {"timeout": 60, "check_same_thread": False}})
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+    from app import create_app, setup_database
+    app = create_app(settings)
+    with app.app_context():
+        db.drop_all()
+        setup_database()
+    return app
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def latency_summary(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+    }
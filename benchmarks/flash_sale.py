@@ -0,0 +1,325 @@
+"""
+Flash sale on the booking flow.
+
+Users register and log in, then all of them book tickets of one event at once (POST /reservation), pay the
+reservations they got (the payments are charged by the payment workers through the PaymentGateway) and poll
+GET /reservation/<id>, GET /event/id/<id> and GET /statistics/events meanwhile, sending back the ETag they got last
+(If-None-Match, --no-etags turns it off). The throughput, the p50/p95/p99 latency, the bytes received and the queries
+per request (X-DB-Queries, METRICS_HEADERS) of every endpoint are written as a JSON artifact, together with the
+oversell count, so runs can be compared:
+
+    python -m benchmarks.flash_sale --users 200 --threads 16 --output before.json
+    python -m benchmarks.flash_sale --users 200 --threads 16 --output after.json
+    python -m benchmarks.flash_sale --compare before.json after.json
+
+By default the app runs in process through the Flask test client, against a temporary SQLite file or
+BENCHMARK_DATABASE_URI. With --url it runs against a local server instead (started with METRICS_HEADERS = True to
+get the queries per request), in that case the event created by the run should be the only one being sold.
+"""
+import argparse
+import json
+import platform
+import queue
+import subprocess
+import threading
+import time
+from datetime import datetime
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from benchmarks.common import latency_summary, load_app
+from utils.conts import ticket_numbers
+
+FINAL_PAYMENT_STATUSES = ("succeeded", "failed")
+
+
+class Response:
+    def __init__(self, status: int, body, headers, size: int):
+        self.status = status
+        self.body = body
+        self.headers = headers
+        self.size = size
+
+    @property
+    def queries(self):
+        value = self.headers.get("X-DB-Queries")
+        return int(value) if value is not None else None
+
+
+# Runs the requests in process, one test client per thread
+class TestClientTransport:
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method: str, path: str, payload=None, headers=None) -> Response:
+        if not hasattr(self.local, "client"):
+            self.local.client = self.app.test_client()
+        response = self.local.client.open(path, method=method, json=payload, headers=headers or {})
+        return Response(response.status_code, response.get_json(silent=True), response.headers,
+                        len(response.get_data()))
+
+
+# Runs the requests against a server, e.g. http://localhost:5000
+class HttpTransport:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def request(self, method: str, path: str, payload=None, headers=None) -> Response:
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = Request(self.url + path, data=data, method=method, headers=dict(headers or {}))
+        if data is not None:
+            request.add_header("Content-Type", "application/json")
+        try:
+            with urlopen(request) as response:
+                raw = response.read()
+                return Response(response.status, json.loads(raw or b"null"), response.headers, len(raw))
+        except HTTPError as e:
+            raw = e.read()
+            return Response(e.code, json.loads(raw or b"null"), e.headers, len(raw))
+
+
+class Recorder:
+    """Latency, status codes, bytes and queries of every request, by endpoint. With etags, the GET requests send
+    back the last ETag the thread got for the same path"""
+
+    def __init__(self, transport, etags: bool = False):
+        self.transport = transport
+        self.etags = etags
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.endpoints = {}
+
+    def request(self, endpoint: str, method: str, path: str, payload=None, headers=None) -> Response:
+        headers = dict(headers or {})
+        known = getattr(self.local, "etags", None)
+        if known is None:
+            known = self.local.etags = {}
+        if self.etags and method == "GET" and path in known:
+            headers["If-None-Match"] = known[path]
+        started = time.perf_counter()
+        response = self.transport.request(method, path, payload, headers)
+        elapsed = time.perf_counter() - started
+        if self.etags and response.headers.get("ETag"):
+            known[path] = response.headers["ETag"]
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {"latencies": [], "statuses": {}, "queries": [], "bytes": 0})
+            stats["latencies"].append(elapsed)
+            stats["statuses"][response.status] = stats["statuses"].get(response.status, 0) + 1
+            stats["bytes"] += response.size
+            if response.queries is not None:
+                stats["queries"].append(response.queries)
+        return response
+
+    def summary(self, seconds: float) -> dict:
+        endpoints = {}
+        for endpoint, stats in sorted(self.endpoints.items()):
+            queries = stats["queries"]
+            endpoints[endpoint] = dict(
+                latency_summary(stats["latencies"]),
+                statuses={str(status): count for status, count in sorted(stats["statuses"].items())},
+                bytes=stats["bytes"],
+                bytes_per_request=round(stats["bytes"] / len(stats["latencies"]), 1),
+                requests_per_second=round(len(stats["latencies"]) / seconds, 2) if seconds else None,
+                queries_per_request=round(sum(queries) / len(queries), 2) if queries else None,
+                max_queries=max(queries) if queries else None,
+            )
+        total = sum(len(stats["latencies"]) for stats in self.endpoints.values())
+        return {
+            "requests": total,
+            "bytes": sum(stats["bytes"] for stats in self.endpoints.values()),
+            "seconds": round(seconds, 4),
+            "requests_per_second": round(total / seconds, 2) if seconds else None,
+            "endpoints": endpoints,
+        }
+
+
+def run_threads(threads: int, jobs: list, work) -> float:
+    pending = queue.Queue()
+    for job in jobs:
+        pending.put(job)
+
+    def worker():
+        while True:
+            try:
+                job = pending.get_nowait()
+            except queue.Empty:
+                return
+            work(job)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def run(transport, users: int, threads: int, attempts: int, ticket_type: str, polls: int,
+        payment_timeout: float, etags: bool = True) -> dict:
+    setup = Recorder(transport)
+    event_id = setup.request("POST /event", "POST", "/event", {
+        "name": "Flash sale {}".format(datetime.utcnow().isoformat()), "date": "2030-01-01", "time": "20:00:00"
+    }).body["id"]
+
+    tokens = {}
+
+    def sign_up(index):
+        credentials = {"username": "flash{}-{}".format(event_id, index), "password": "secret"}
+        setup.request("POST /register", "POST", "/register", credentials)
+        response = setup.request("POST /login", "POST", "/login", credentials)
+        if response.status == 200:
+            tokens[index] = response.body["access_token"]
+
+    setup_seconds = run_threads(threads, list(range(users)), sign_up)
+
+    sale = Recorder(transport, etags)
+    reserved, payments, errors = [], [], []
+    lock = threading.Lock()
+
+    def buy(index):
+        headers = {"Authorization": "Bearer " + tokens[index]}
+        for _ in range(attempts):
+            response = sale.request("POST /reservation", "POST", "/reservation",
+                                    {"event_id": event_id, "ticket_type": ticket_type}, headers)
+            if response.status != 201:
+                if response.status >= 400:
+                    with lock:
+                        errors.append(response.status)
+                continue
+            reservation_id = response.body["reservation_id"]
+            with lock:
+                reserved.append(reservation_id)
+            for _ in range(polls):
+                sale.request("GET /reservation/<id>", "GET", "/reservation/{}".format(reservation_id))
+                sale.request("GET /event/id/<id>", "GET", "/event/id/{}".format(event_id))
+                sale.request("GET /statistics/events", "GET", "/statistics/events")
+            submitted = time.perf_counter()
+            response = sale.request("POST /reservation/<id>", "POST", "/reservation/{}".format(reservation_id),
+                                    {"amount": 100, "token": "benchmark"}, headers)
+            if response.status == 202:
+                payments.append(wait_for_payment(sale, response.body["payment_id"], submitted, payment_timeout))
+
+    sale_seconds = run_threads(threads, sorted(tokens), buy)
+
+    check = Recorder(transport)
+    event = check.request("GET /event/id/<id>", "GET", "/event/id/{}".format(event_id)).body
+    available = {ticket["ticket_type"]: ticket["number_available"] for ticket in event["tickets"]}
+    statistics = check.request("GET /statistics/event/<id>", "GET", "/statistics/event/{}".format(event_id)).body
+    tally = statistics["reservations"]["details"][ticket_type]
+
+    capacity = ticket_numbers[ticket_type]
+    settled = [payment for payment in payments if payment["status"] in FINAL_PAYMENT_STATUSES]
+    return {
+        "users": users,
+        "logged_in": len(tokens),
+        "threads": threads,
+        "attempts": users * attempts,
+        "etags": etags,
+        "ticket_type": ticket_type,
+        "capacity": capacity,
+        "reserved": len(reserved),
+        "number_available": available.get(ticket_type),
+        "statistics": tally,
+        "oversell": max(0, len(reserved) - capacity),
+        "inventory_drift": capacity - len(reserved) - available.get(ticket_type, 0),
+        "errors": len(errors),
+        "setup": setup.summary(setup_seconds),
+        "sale": sale.summary(sale_seconds),
+        "payments": dict(
+            latency_summary([payment["seconds"] for payment in settled]),
+            submitted=len(payments),
+            succeeded=sum(1 for payment in payments if payment["status"] == "succeeded"),
+            failed=sum(1 for payment in payments if payment["status"] == "failed"),
+            unsettled=len(payments) - len(settled),
+        ),
+    }
+
+
+# Polls the payment until the workers charged it, the time from the submission is kept
+def wait_for_payment(recorder: Recorder, payment_id: str, submitted: float, timeout: float) -> dict:
+    status = None
+    while time.perf_counter() - submitted < timeout:
+        status = recorder.request("GET /payment/<id>", "GET", "/payment/{}".format(payment_id)).body["status"]
+        if status in FINAL_PAYMENT_STATUSES:
+            break
+        time.sleep(0.05)
+    return {"status": status, "seconds": time.perf_counter() - submitted}
+
+
+def environment(url: str, app=None) -> dict:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "commit": commit.strip() if commit else None,
+        "python": platform.python_version(),
+        "target": url or "test client",
+        "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0] if app else None,
+    }
+
+
+# Differences of the second run with the first one, for the totals and every endpoint of the sale
+def compare(before: dict, after: dict) -> list:
+    def delta(old, new):
+        if old is None or new is None:
+            return "{} -> {}".format(old, new)
+        change = "{:+.1%}".format((new - old) / old) if old else "n/a"
+        return "{} -> {} ({})".format(old, new, change)
+
+    lines = ["{:<28}{}".format("sale requests/s", delta(before["sale"]["requests_per_second"],
+                                                        after["sale"]["requests_per_second"]))]
+    lines.append("{:<28}{}".format("sale bytes", delta(before["sale"].get("bytes"), after["sale"].get("bytes"))))
+    for endpoint, new in after["sale"]["endpoints"].items():
+        old = before["sale"]["endpoints"].get(endpoint, {})
+        lines.append(endpoint)
+        for key in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms", "bytes_per_request", "queries_per_request"):
+            lines.append("    {:<24}{}".format(key, delta(old.get(key), new.get(key))))
+    lines.append("{:<28}{}".format("oversell", delta(before["oversell"], after["oversell"])))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--attempts", type=int, default=2, help="reservation attempts per user")
+    parser.add_argument("--ticket-type", default="Regular", choices=sorted(ticket_numbers))
+    parser.add_argument("--polls", type=int, default=2, help="reservation and statistics polls per reservation")
+    parser.add_argument("--payment-timeout", type=float, default=30)
+    parser.add_argument("--no-etags", action="store_true", help="poll without sending If-None-Match")
+    parser.add_argument("--hash-rounds", type=int, default=1000, help="PASSWORD_HASH_ROUNDS of the in process app")
+    parser.add_argument("--url", help="base URL of a running server, instead of the in process app")
+    parser.add_argument("--output", help="file the JSON artifact is written to, printed otherwise")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two JSON artifacts")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before_file, open(args.compare[1]) as after_file:
+            print("\n".join(compare(json.load(before_file), json.load(after_file))))
+        raise SystemExit
+
+    app = None
+    if args.url:
+        transport = HttpTransport(args.url)
+    else:
+        app = load_app(METRICS_HEADERS=True, PASSWORD_HASH_ROUNDS=args.hash_rounds, PAYMENT_POLL_INTERVAL=0.2)
+        from utils.background import background
+        # the payments are charged by the background workers
+        background.start()
+        transport = TestClientTransport(app)
+
+    result = dict(environment(args.url, app), **run(transport, args.users, args.threads, args.attempts,
+                                                    args.ticket_type, args.polls, args.payment_timeout,
+                                                    not args.no_etags))
+    artifact = json.dumps(result, indent=4)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(artifact + "\n")
+    else:
+        print(artifact)
+    assert result["oversell"] == 0, "tickets were oversold"
+    assert result["inventory_drift"] == 0, "inventory drifted"
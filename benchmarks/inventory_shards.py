@@ -0,0 +1,113 @@
+"""
+Throughput of a single event flash sale with the ticket pool split across more and more shards.
+
+For every shard count a fresh database gets one event whose pool holds --capacity tickets, then many threads reserve
+from it at once until it is sold out. Every transaction keeps what it claimed locked for --hold-ms more (the rest of a
+request: the reservation insert, the counters, the response) before committing, which is what makes a single pool row
+the bottleneck. Reservations per second are reported per shard count, along with the oversell and the drift of the
+tickets taken and of the counters against the reservations stored (all of them have to be zero).
+
+    python -m benchmarks.inventory_shards --shards 1 2 4 8 --threads 32 --capacity 2000
+
+SQLite locks the whole database for every writer, so the numbers only scale with the shards on a database with row
+locks: point BENCHMARK_DATABASE_URI to a local Postgres.
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import date, time as dt_time
+
+from benchmarks.common import load_app
+from db import db
+from models.counter import CounterModel
+from models.event import EventModel
+from models.reservation import ReservationModel
+from models.ticket import TicketModel
+from models.user import UserModel
+
+
+def run(shard_count: int, threads: int, capacity: int, ticket_type: str, hold: float) -> dict:
+    # the sold out flags and the cached availability would hide the contention being measured
+    app = load_app(ADMISSION_ENABLED=False, CACHE_AVAILABILITY_TTL=0)
+    with app.app_context():
+        user = UserModel(username="benchmark", password="benchmark")
+        event = EventModel(name="Flash sale", date=date.today(), time=dt_time(20, 0))
+        db.session.add_all([user, event])
+        db.session.flush()
+        event.find_by_ticket_type(ticket_type).number_available = capacity
+        db.session.flush()
+        TicketModel.shard(event.id, ticket_type, shard_count)
+        db.session.commit()
+        user_id, event_id = user.id, event.id
+
+    reserved = []
+    errors = []
+    start_barrier = threading.Barrier(threads)
+
+    def worker():
+        count = 0
+        with app.app_context():
+            start_barrier.wait()
+            while True:
+                try:
+                    if not ReservationModel(user_id=user_id, event_id=event_id, ticket_type=ticket_type).reserve():
+                        break
+                    time.sleep(hold)
+                    db.session.commit()
+                    count += 1
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(repr(e))
+            db.session.remove()
+        reserved.append(count)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        stored = ReservationModel.query.filter_by(event_id=event_id, ticket_type=ticket_type).count()
+        available = TicketModel.query.filter_by(event_id=event_id, ticket_type=ticket_type).one().available
+        counted = sum(counter.total for counter in CounterModel.query.filter_by(event_id=event_id,
+                                                                                ticket_type=ticket_type))
+        db.session.remove()
+    db.get_engine(app).dispose()
+
+    return {
+        "shards": shard_count,
+        "threads": threads,
+        "capacity": capacity,
+        "reserved": sum(reserved),
+        "stored_reservations": stored,
+        "number_available": available,
+        "oversell": max(0, stored - capacity),
+        "inventory_drift": capacity - available - stored,
+        "counter_drift": counted - stored,
+        "errors": len(errors),
+        "seconds": round(elapsed, 4),
+        "reservations_per_second": round(sum(reserved) / elapsed, 2) if elapsed else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--capacity", type=int, default=2000, help="tickets in the pool being sold")
+    parser.add_argument("--ticket-type", default="VIP")
+    parser.add_argument("--hold-ms", type=float, default=2.0,
+                        help="time every transaction keeps its claim before committing")
+    args = parser.parse_args()
+
+    results = [run(shards, args.threads, args.capacity, args.ticket_type, args.hold_ms / 1000)
+               for shards in args.shards]
+    print(json.dumps(results, indent=4))
+    for result in results:
+        assert result["oversell"] == 0, "tickets were oversold with {} shards".format(result["shards"])
+        assert result["inventory_drift"] == 0, "inventory drifted with {} shards".format(result["shards"])
+        assert result["counter_drift"] == 0, "counters drifted with {} shards".format(result["shards"])
@@ -0,0 +1,117 @@
+"""
+Live updates of an event (GET /event/id/<id>/stream) against polling it.
+
+--subscribers clients open the stream of one event while reservations are made at --rate per second for --seconds.
+Reports how long the availability took to reach every subscriber after each reservation was committed, and the queries
+run by the poller of the live hub, which do not grow with the subscribers, next to the requests the same clients would
+make polling GET /event/id/<id> every --poll-interval seconds.
+
+    python -m benchmarks.live_updates --subscribers 50 --rate 5 --seconds 10
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import date, time as dt_time
+
+from sqlalchemy import event as sqlalchemy_event
+
+from benchmarks.common import latency_summary, load_app
+from db import db
+from models.event import EventModel
+from models.reservation import ReservationModel
+from models.user import UserModel
+from utils.conts import ticket_numbers
+
+
+def read_stream(client, event_id: int, ticket_type: str, seen: list, stop: threading.Event) -> None:
+    response = client.get("/event/id/{}/stream".format(event_id), buffered=False)
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        for message in chunk.split("\n\n"):
+            if message.startswith("event: availability"):
+                data = json.loads(message.split("data: ", 1)[1])
+                available = {ticket["ticket_type"]: ticket["number_available"] for ticket in data["tickets"]}
+                seen.append((time.perf_counter(), available[ticket_type]))
+        if stop.is_set():
+            break
+    response.close()
+
+
+def run(subscribers: int, rate: float, seconds: float, poll_interval: float, ticket_type: str) -> dict:
+    app = load_app(LIVE_MAX_SUBSCRIBERS=subscribers, LIVE_HEARTBEAT=0.5, ADMISSION_ENABLED=False)
+    with app.app_context():
+        user = UserModel(username="benchmark", password="benchmark")
+        event = EventModel(name="Live", date=date.today(), time=dt_time(20, 0))
+        db.session.add_all([user, event])
+        db.session.commit()
+        user_id, event_id = user.id, event.id
+
+    poller_queries = []
+
+    def count_poller_query(*args):
+        if threading.current_thread().name == "live-poller":
+            poller_queries.append(1)
+    with app.app_context():
+        engine = db.get_engine(app)
+    sqlalchemy_event.listen(engine, "before_cursor_execute", count_poller_query)
+
+    stop = threading.Event()
+    seen = [[] for _ in range(subscribers)]
+    readers = [threading.Thread(target=read_stream, args=(app.test_client(), event_id, ticket_type, seen[index], stop))
+               for index in range(subscribers)]
+    for reader in readers:
+        reader.start()
+
+    committed = []
+    started = time.perf_counter()
+    with app.app_context():
+        while time.perf_counter() - started < seconds:
+            if ReservationModel(user_id=user_id, event_id=event_id, ticket_type=ticket_type).reserve():
+                db.session.commit()
+                committed.append(time.perf_counter())
+            time.sleep(1 / rate)
+        db.session.remove()
+    # the last changes still have to go through a poll
+    time.sleep(app.config["LIVE_POLL_INTERVAL"] * 2)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for reader in readers:
+        reader.join()
+    sqlalchemy_event.remove(engine, "before_cursor_execute", count_poller_query)
+
+    # delay between a reservation being committed and each subscriber seeing the availability it left
+    capacity = ticket_numbers[ticket_type]
+    delays = []
+    missed = 0
+    for received in seen:
+        for index, committed_at in enumerate(committed):
+            left = capacity - index - 1
+            delivered = next((at for at, available in received if available <= left), None)
+            if delivered is None:
+                missed += 1
+            else:
+                delays.append(max(0.0, delivered - committed_at))
+    return {
+        "subscribers": subscribers,
+        "reservations": len(committed),
+        "seconds": round(elapsed, 2),
+        "delivery": latency_summary(delays),
+        "missed_updates": missed,
+        "poller_queries_per_second": round(len(poller_queries) / elapsed, 2),
+        "polling_requests_per_second": round(subscribers / poll_interval, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=5, help="reservations per second")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--poll-interval", type=float, default=1, help="seconds between the polls of a client")
+    parser.add_argument("--ticket-type", default="Regular")
+    args = parser.parse_args()
+
+    result = run(args.subscribers, args.rate, args.seconds, args.poll_interval, args.ticket_type)
+    print(json.dumps(result, indent=4))
+    assert result["missed_updates"] == 0, "some subscribers did not get the last availability"
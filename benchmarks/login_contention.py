@@ -0,0 +1,76 @@
+"""
+Login burst while reservations are being made.
+
+Login threads keep hashing passwords while reservation threads book tickets, the latency (p50/p95/p99) of both is
+reported so the effect of PASSWORD_HASH_WORKERS / PASSWORD_HASH_MAX_PENDING on the booking flow can be compared.
+
+    python -m benchmarks.login_contention --login-threads 16 --reservation-threads 4 --hash-workers 2
+"""
+import argparse
+import json
+import threading
+import time
+
+from benchmarks.common import latency_summary, load_app
+
+
+def run(login_threads: int, reservation_threads: int, seconds: float, hash_workers: int, max_pending: int) -> dict:
+    app = load_app(PASSWORD_HASH_WORKERS=hash_workers, PASSWORD_HASH_MAX_PENDING=max_pending)
+    client = app.test_client()
+    client.post("/event", json={"name": "Flash sale", "date": "2030-01-01", "time": "20:00:00"})
+    client.post("/register", json={"username": "booker", "password": "booker"})
+    token = client.post("/login", json={"username": "booker", "password": "booker"}).get_json()["access_token"]
+    for index in range(login_threads):
+        client.post("/register", json={"username": "user{}".format(index), "password": "secret"})
+
+    logins, reservations, statuses = [], [], {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def timed(append, call):
+        started = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - started
+        with lock:
+            append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    def login_worker(index):
+        thread_client = app.test_client()
+        payload = {"username": "user{}".format(index), "password": "secret"}
+        while time.perf_counter() < deadline:
+            timed(logins.append, lambda: thread_client.post("/login", json=payload))
+
+    def reservation_worker():
+        thread_client = app.test_client()
+        headers = {"Authorization": "Bearer " + token}
+        while time.perf_counter() < deadline:
+            timed(reservations.append, lambda: thread_client.post(
+                "/reservation", json={"event_id": 1, "ticket_type": "Regular"}, headers=headers))
+
+    threads = [threading.Thread(target=login_worker, args=(index,)) for index in range(login_threads)]
+    threads += [threading.Thread(target=reservation_worker) for _ in range(reservation_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        "hash_workers": hash_workers,
+        "max_pending": max_pending,
+        "login": latency_summary(logins),
+        "reservation": latency_summary(reservations),
+        "statuses": statuses,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--login-threads", type=int, default=16)
+    parser.add_argument("--reservation-threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--hash-workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=16)
+    args = parser.parse_args()
+    print(json.dumps(run(args.login_threads, args.reservation_threads, args.seconds, args.hash_workers,
+                         args.max_pending), indent=4))
@@ -0,0 +1,94 @@
+"""
+Concurrency check for the reservation hot path.
+
+Many threads try to reserve the same ticket pool at once, at the end the number of reservations has to match exactly
+the tickets taken from the pool (zero oversell). Reservations per second are reported as well.
+
+    python -m benchmarks.reservation_concurrency --threads 32 --attempts 20
+
+BENCHMARK_DATABASE_URI can point to a local Postgres, by default a temporary SQLite file is used.
+"""
+import argparse
+import threading
+import time
+from datetime import date, time as dt_time
+
+from benchmarks.common import load_app
+from db import db
+from models.event import EventModel
+from models.reservation import ReservationModel
+from models.ticket import TicketModel
+from models.user import UserModel
+from utils.conts import ticket_numbers
+
+
+def run(threads: int, attempts: int, ticket_type: str) -> dict:
+    # the sold out flags and the cached availability would hide the contention being measured
+    app = load_app(ADMISSION_ENABLED=False, CACHE_AVAILABILITY_TTL=0)
+    with app.app_context():
+        user = UserModel(username="benchmark", password="benchmark")
+        event = EventModel(name="Flash sale", date=date.today(), time=dt_time(20, 0))
+        db.session.add_all([user, event])
+        db.session.commit()
+        user_id, event_id = user.id, event.id
+
+    successes = []
+    errors = []
+    start_barrier = threading.Barrier(threads)
+
+    def worker():
+        reserved = 0
+        with app.app_context():
+            start_barrier.wait()
+            for _ in range(attempts):
+                try:
+                    if ReservationModel(user_id=user_id, event_id=event_id, ticket_type=ticket_type).reserve():
+                        db.session.commit()
+                        reserved += 1
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(repr(e))
+            db.session.remove()
+        successes.append(reserved)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        stored = ReservationModel.query.filter_by(event_id=event_id, ticket_type=ticket_type).count()
+        available = TicketModel.query.filter_by(event_id=event_id, ticket_type=ticket_type).one().available
+        db.session.remove()
+    db.get_engine(app).dispose()
+
+    capacity = ticket_numbers[ticket_type]
+    return {
+        "threads": threads,
+        "attempts": threads * attempts,
+        "capacity": capacity,
+        "reserved": sum(successes),
+        "stored_reservations": stored,
+        "number_available": available,
+        "oversell": max(0, stored - capacity),
+        "errors": len(errors),
+        "seconds": round(elapsed, 4),
+        "reservations_per_second": round(sum(successes) / elapsed, 2) if elapsed else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--attempts", type=int, default=20, help="reservation attempts per thread")
+    parser.add_argument("--ticket-type", default="VIP")
+    args = parser.parse_args()
+
+    result = run(args.threads, args.attempts, args.ticket_type)
+    for key, value in result.items():
+        print("{:<24}{}".format(key, value))
+    assert result["oversell"] == 0, "tickets were oversold"
+    assert result["stored_reservations"] + result["number_available"] == result["capacity"], "inventory drifted"
@@ -0,0 +1,102 @@
+"""
+Serialization of the responses: marshmallow dumps and the flask-restful JSON representation against the compiled
+serializers (utils.serializers) and utils.representations.
+
+Builds events with their tickets and reservations in memory (no database), checks that both paths give the same
+bytes and reports the best time of every step over a few repeats:
+
+    python -m benchmarks.serializers --events 10000 --repeat 5
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+from flask import Flask
+from flask_restful import Api
+from flask_restful.representations.json import output_json
+
+import models  # noqa: F401 (registers every model, so the relationships can be resolved)
+from models.event import EventModel
+from models.reservation import ReservationModel
+from schemas.event import EventSchema
+from schemas.reservation import ReservationSchema
+from utils.representations import JSONRepresentation
+from utils.serializers import compile_dump
+
+
+def build_events(count: int) -> list:
+    events = []
+    for index in range(count):
+        event = EventModel(name="Event {}".format(index), date=date(2030, 1, 1) + timedelta(days=index % 365),
+                           time=dt_time(20, index % 60))
+        event.id = index + 1
+        for ticket in event.tickets:
+            ticket.number_available -= index % 30
+        events.append(event)
+    return events
+
+
+def build_reservations(count: int) -> list:
+    reservations = []
+    for index in range(count):
+        reservation = ReservationModel(user_id=index % 100 + 1, event_id=index % 50 + 1, ticket_type="VIP")
+        reservation.paid = index % 3 == 0
+        # already expired, so the remaining time does not change between the dumps being compared
+        reservation.expire_at = datetime.now() - timedelta(minutes=index % 10)
+        reservations.append(reservation)
+    return reservations
+
+
+def best(function, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def compare(name: str, schema, objects: list, representation: JSONRepresentation, repeat: int) -> dict:
+    compiled = compile_dump(schema)
+    dump_seconds, dumped = best(lambda: schema.dump(objects), repeat)
+    compiled_seconds, compiled_dumped = best(lambda: compiled(objects), repeat)
+    data = {name: dumped}
+    encode_seconds, encoded = best(lambda: output_json(data, 200).get_data(), repeat)
+    fast_encode_seconds, fast_encoded = best(lambda: representation.output({name: compiled_dumped}, 200).get_data(),
+                                             repeat)
+    assert compiled_dumped == dumped, "the compiled {} dump differs".format(name)
+    assert fast_encoded == encoded, "the {} response bytes differ".format(name)
+    return {
+        "objects": len(objects),
+        "bytes": len(encoded),
+        "dump_ms": round(dump_seconds * 1000, 2),
+        "compiled_dump_ms": round(compiled_seconds * 1000, 2),
+        "dump_speedup": round(dump_seconds / compiled_seconds, 2),
+        "encode_ms": round(encode_seconds * 1000, 2),
+        "fast_encode_ms": round(fast_encode_seconds * 1000, 2),
+        "total_speedup": round((dump_seconds + encode_seconds) / (compiled_seconds + fast_encode_seconds), 2),
+    }
+
+
+def run(events: int, repeat: int, debug: bool) -> dict:
+    app = Flask(__name__)
+    app.debug = debug
+    representation = JSONRepresentation()
+    representation.init_app(app, Api(app))
+    with app.app_context():
+        return {
+            "debug": debug,
+            "events": compare("events", EventSchema(many=True), build_events(events), representation, repeat),
+            "reservations": compare("reservations", ReservationSchema(many=True), build_reservations(events),
+                                    representation, repeat),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--debug", action="store_true", help="indented output, as in debug mode")
+    args = parser.parse_args()
+    print(json.dumps(run(args.events, args.repeat, args.debug), indent=4))
@@ -1,9 +1,98 @@
 """
 blacklist.py
 
-This file just contains the blacklist of the JWT tokens–it will be imported by
-app and the logout resource so that tokens can be added to the blacklist when the
-user logs out.
+This file contains the blacklist of the JWT tokens–it will be imported by app and the logout resource so that tokens
+can be added to the blacklist when the user logs out.
+
+Revoked tokens are forgotten once they expire. The memory store only works for a single process, the database store
+is shared by every worker and keeps two in-process caches in front of it: the tokens known to be revoked, and the
+tokens recently checked and found valid (for JWT_REVOCATION_NEGATIVE_TTL seconds), so the check done on every
+request does not need a database round trip. A logout done in another worker is therefore seen after at most
+JWT_REVOCATION_NEGATIVE_TTL seconds.
 """
+import threading
+import time
+from datetime import datetime
+
+from models.revoked_token import RevokedTokenModel
+from utils.lru import TTLCache
+
+
+class MemoryRevocationStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+
+    def add(self, jti: str, expires_at: int = None) -> None:
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def __contains__(self, jti: str) -> bool:
+        with self._lock:
+            if jti not in self._revoked:
+                return False
+            expires_at = self._revoked[jti]
+            if expires_at is not None and expires_at <= time.time():
+                del self._revoked[jti]
+                return False
+            return True
+
+    def purge(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [jti for jti, expires_at in self._revoked.items() if expires_at is not None and expires_at <= now]
+            for jti in expired:
+                del self._revoked[jti]
+        return len(expired)
+
+
+class DatabaseRevocationStore:
+    def __init__(self, cache_size: int, negative_ttl: float):
+        self.negative_ttl = negative_ttl
+        self._revoked = TTLCache(cache_size)
+        self._valid = TTLCache(cache_size)
+
+    def add(self, jti: str, expires_at: int = None) -> None:
+        RevokedTokenModel.revoke(jti, datetime.utcfromtimestamp(expires_at) if expires_at is not None else None)
+        self._valid.delete(jti)
+        self._revoked.set(jti, True, expires_at)
+
+    def __contains__(self, jti: str) -> bool:
+        if self._revoked.get(jti):
+            return True
+        if self._valid.get(jti):
+            return False
+        if RevokedTokenModel.is_revoked(jti):
+            self._revoked.set(jti, True)
+            return True
+        self._valid.set(jti, True, time.time() + self.negative_ttl)
+        return False
+
+    def purge(self) -> int:
+        return RevokedTokenModel.purge_expired()
+
+
+class RevocationStore:
+    """Delegates to the store selected by JWT_REVOCATION_STORE ("memory" or "database") once init_app is called"""
+
+    def __init__(self):
+        self.store = MemoryRevocationStore()
+
+    def init_app(self, app) -> None:
+        if app.config.get("JWT_REVOCATION_STORE", "memory") == "database":
+            self.store = DatabaseRevocationStore(app.config.get("JWT_REVOCATION_CACHE_SIZE", 10000),
+                                                 app.config.get("JWT_REVOCATION_NEGATIVE_TTL", 5))
+        else:
+            self.store = MemoryRevocationStore()
+
+    def add(self, jti: str, expires_at: int = None) -> None:
+        self.store.add(jti, expires_at)
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self.store
+
+    def purge(self) -> int:
+        return self.store.purge()
+
 
-BLACKLIST = set()
+BLACKLIST = RevocationStore()
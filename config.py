@@ -13,8 +13,115 @@ SQLALCHEMY_DATABASE_URI = 'postgresql://{user}:{pw}@{host}:{port}/{db}'.format(
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 PROPAGATE_EXCEPTIONS = True
 
+# Encoder of the JSON responses: "json" (same output as flask-restful, with the encoders built once) or "orjson"
+# (faster, needs the orjson package, compact output)
+JSON_BACKEND = "json"
+
+# Event snapshots and ticket availability are cached in process, and in Redis as well with CACHE_BACKEND = "redis".
+# Events are kept CACHE_EVENT_TTL seconds, the availability is never served older than CACHE_AVAILABILITY_TTL seconds
+CACHE_ENABLED = True
+CACHE_BACKEND = "memory"
+CACHE_REDIS_URL = "redis://localhost:6379/0"
+CACHE_MAX_ENTRIES = 10000
+CACHE_EVENT_TTL = 300
+CACHE_AVAILABILITY_TTL = 1
+
+# Reservations of the same event and ticket type are admitted ADMISSION_MAX_ACTIVE at a time per process, at most
+# ADMISSION_MAX_QUEUE wait (for up to ADMISSION_WAIT_TIMEOUT seconds) and the rest get a 503 with their queue position.
+# A sold out pool is answered from memory for ADMISSION_SOLD_OUT_TTL seconds
+ADMISSION_ENABLED = True
+ADMISSION_MAX_ACTIVE = 8
+ADMISSION_MAX_QUEUE = 200
+ADMISSION_WAIT_TIMEOUT = 5
+ADMISSION_SOLD_OUT_TTL = 5
+
+# Ticket pools of new events are split across INVENTORY_SHARDS rows (1 keeps a single row), so the reservations of a
+# flash sale do not all wait for the lock of the same row. Existing events: flask shard-inventory <event id> --shards N
+INVENTORY_SHARDS = 1
+
+# Live updates (GET /event/id/<id>/stream, Server-Sent Events): every process polls the watched events and reservations
+# every LIVE_POLL_INTERVAL seconds and keeps at most LIVE_MAX_SUBSCRIBERS streams open (keep it below the threads of
+# uwsgi.ini), each following up to LIVE_MAX_RESERVATIONS reservations. A stream that lets LIVE_MAX_QUEUE messages pile
+# up is closed, the others send a heartbeat every LIVE_HEARTBEAT seconds and are closed after LIVE_STREAM_TIMEOUT
+# seconds, browsers reconnect LIVE_RETRY seconds later
+LIVE_ENABLED = True
+LIVE_POLL_INTERVAL = 1
+LIVE_MAX_SUBSCRIBERS = 100
+LIVE_MAX_RESERVATIONS = 10
+LIVE_MAX_QUEUE = 100
+LIVE_HEARTBEAT = 15
+LIVE_STREAM_TIMEOUT = 300
+LIVE_RETRY = 3
+
+# Only the process holding the background lease runs the periodic jobs, it renews the lease every
+# BACKGROUND_LEASE_RENEW seconds and another process takes over BACKGROUND_LEASE_TTL seconds after it stopped doing so
+BACKGROUND_LEASE_TTL = 15
+BACKGROUND_LEASE_RENEW = 5
+
+# Expired reservations are released by a periodic sweeper, every EXPIRY_SWEEP_INTERVAL seconds in batches
+EXPIRY_SWEEP_INTERVAL = 5
+EXPIRY_SWEEP_BATCH_SIZE = 500
+
+# Reservations that can not change anymore are moved to the archive every ARCHIVE_INTERVAL seconds, at most
+# ARCHIVE_MAX_BATCHES batches of ARCHIVE_BATCH_SIZE per run: the unpaid ones ARCHIVE_EXPIRED_AFTER seconds after they
+# expired and the ones of events that took place more than ARCHIVE_PAST_EVENTS_AFTER seconds ago
+ARCHIVE_INTERVAL = 300
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_MAX_BATCHES = 10
+ARCHIVE_EXPIRED_AFTER = 86400
+ARCHIVE_PAST_EVENTS_AFTER = 604800
+
+# Payments are queued and charged by PAYMENT_WORKERS threads, pending payments are picked up every
+# PAYMENT_POLL_INTERVAL seconds, at most PAYMENT_BATCH_SIZE at a time. Every PAYMENT_REAP_INTERVAL seconds the payments
+# still processing PAYMENT_PROCESSING_TIMEOUT seconds after they were picked up are failed
+PAYMENT_WORKERS = 4
+PAYMENT_POLL_INTERVAL = 1
+PAYMENT_BATCH_SIZE = 50
+PAYMENT_PROCESSING_TIMEOUT = 300
+PAYMENT_REAP_INTERVAL = 60
+
+# Most tickets a single group reservation (POST /reservations) can book
+GROUP_RESERVATION_MAX_TICKETS = 20
+
+# Bulk event imports commit every EVENT_IMPORT_CHUNK_SIZE events and report at most EVENT_IMPORT_MAX_ERRORS rows
+EVENT_IMPORT_CHUNK_SIZE = 500
+EVENT_IMPORT_MAX_ERRORS = 100
+
+# /events is paginated, ?limit= can ask for at most EVENTS_MAX_PAGE_SIZE events
+EVENTS_PAGE_SIZE = 50
+EVENTS_MAX_PAGE_SIZE = 200
+
+# /user/<id>/reservations is paginated as well, ?limit= can ask for at most USER_RESERVATIONS_MAX_PAGE_SIZE reservations
+USER_RESERVATIONS_PAGE_SIZE = 50
+USER_RESERVATIONS_MAX_PAGE_SIZE = 200
+
+# /statistics/event/<id>/timeseries counts per ?bucket= seconds (TIMESERIES_BUCKET by default) over the last
+# TIMESERIES_RANGE seconds unless ?from= and ?to= are given, at most TIMESERIES_MAX_BUCKETS buckets. Buckets that ended
+# TIMESERIES_CLOSE_DELAY seconds ago are closed and cached for TIMESERIES_CACHE_TTL seconds
+TIMESERIES_BUCKET = 60
+TIMESERIES_RANGE = 3600
+TIMESERIES_MAX_BUCKETS = 1440
+TIMESERIES_CLOSE_DELAY = 5
+TIMESERIES_CACHE_TTL = 3600
+
+# Request, query and job metrics on /metrics, METRICS_HEADERS adds the per-request database figures to the responses
+METRICS_ENABLED = True
+METRICS_HEADERS = False
+
+# Password hashing runs in a pool of PASSWORD_HASH_WORKERS processes, past PASSWORD_HASH_MAX_PENDING hashes in progress
+# logins and registrations are rejected with a 503. Changing the rounds rehashes the passwords on the next login
+PASSWORD_HASH_ROUNDS = 30000
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_PENDING = 16
+PASSWORD_HASH_TIMEOUT = 10
+
 JWT_SECRET_KEY = os.environ["JWT_SECRET_KEY"]
 JWT_BLACKLIST_ENABLED = True
 JWT_BLACKLIST_TOKEN_CHECKS = [
     "access",
 ]  # allow blacklisting for access and refresh tokens
+# "database" shares the revoked tokens between every worker, "memory" only works with a single process
+JWT_REVOCATION_STORE = "database"
+JWT_REVOCATION_CACHE_SIZE = 10000
+JWT_REVOCATION_NEGATIVE_TTL = 5  # seconds a token found valid is not checked against the database again
+JWT_REVOCATION_PURGE_INTERVAL = 3600
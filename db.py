@@ -1,3 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
+
+
+class StagedMixin:
+    """save_to_db / delete_from_db of the models. They only stage the change (flushed, so the constraints are checked
+    and the ids assigned) and never commit: a request commits once at the end (see utils.unit_of_work), CLI commands
+    and background jobs commit on their own"""
+
+    def save_to_db(self) -> None:
+        db.session.add(self)
+        db.session.flush()
+
+    def delete_from_db(self) -> None:
+        db.session.delete(self)
+        db.session.flush()
@@ -1,4 +1,11 @@
+import models.counter
 import models.event
+import models.lease
+import models.payment
 import models.reservation
+import models.reservation_archive
+import models.reservation_rollup
+import models.revoked_token
 import models.ticket
+import models.ticket_shard
 import models.user
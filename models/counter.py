@@ -0,0 +1,122 @@
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+
+
+class CounterModel(db.Model):
+    """Reservation counters per event and ticket type, kept up to date in the same transaction as the reservation
+    changes so the statistics never have to scan the reservations table. They are sharded like the ticket pool (see
+    TicketModel.shard), the counters of a pool are the sum of its shards"""
+
+    __tablename__ = "reservation_counters"
+
+    event_id = db.Column(db.Integer, db.ForeignKey("events.id"), primary_key=True)
+    ticket_type = db.Column(db.String(10), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, default=0, autoincrement=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    paid = db.Column(db.Integer, nullable=False, default=0)
+    expired = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped on every change of the counters, the ETags of the statistics are derived from it
+    version = db.Column(db.Integer, nullable=False, default=0)
+    event = db.relationship("EventModel", back_populates="counters")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.shard = kwargs.get("shard", 0)
+        self.total = self.paid = self.expired = self.version = 0
+
+    # Atomic increment of one or more counters (e.g. total=1) of a shard, nothing is committed here, the caller owns
+    # the transaction. Shard 0 is created if the pool has no counters yet (events created before the counters existed)
+    @classmethod
+    def increment(cls, event_id: int, ticket_type: str, shard: int = 0, **amounts) -> None:
+        values = {getattr(cls, column): getattr(cls, column) + amount for column, amount in amounts.items()}
+        values[cls.version] = cls.version + 1
+        updated = cls.query.filter_by(event_id=event_id, ticket_type=ticket_type, shard=shard).update(
+            values, synchronize_session=False)
+        if updated:
+            return
+        if shard:
+            # the pool was resharded meanwhile, its counters always keep shard 0
+            cls.increment(event_id, ticket_type, **amounts)
+            return
+        counter = cls(event_id=event_id, ticket_type=ticket_type)
+        for column, amount in amounts.items():
+            setattr(counter, column, amount)
+        counter.version = 1
+        try:
+            with db.session.begin_nested():
+                db.session.add(counter)
+        except IntegrityError:
+            # created by a concurrent transaction, which committed first
+            cls.increment(event_id, ticket_type, **amounts)
+
+    # Folds the counters of the pool into shard 0 and gives it shard_count shards (at least the one), called by
+    # TicketModel.shard with the pool row locked. Nothing is committed here
+    @classmethod
+    def reshard(cls, event_id: int, ticket_type: str, shard_count: int) -> None:
+        counters = {counter.shard: counter
+                    for counter in cls.query.filter_by(event_id=event_id, ticket_type=ticket_type).with_for_update()}
+        first = counters.get(0)
+        if first is None:
+            first = counters[0] = cls(event_id=event_id, ticket_type=ticket_type)
+            db.session.add(first)
+        for shard in range(1, max(shard_count, 1, *counters) + 1):
+            counter = counters.get(shard)
+            if counter is None:
+                if shard < shard_count:
+                    db.session.add(cls(event_id=event_id, ticket_type=ticket_type, shard=shard))
+                continue
+            first.total += counter.total
+            first.paid += counter.paid
+            first.expired += counter.expired
+            counter.total = counter.paid = counter.expired = 0
+            counter.version += 1
+            if shard >= shard_count:
+                db.session.delete(counter)
+        first.version = (first.version or 0) + 1
+        db.session.flush()
+
+    # Recomputes every counter from the aggregated reservation rows (see ReservationModel.aggregate_counts) and
+    # returns the drift found as a list of dicts. Counters are only overwritten when fix is True
+    @classmethod
+    def rebuild(cls, aggregated_rows, pools, fix: bool = True) -> list:
+        expected = {pool: {"total": 0, "paid": 0, "expired": 0} for pool in pools}
+        for event_id, ticket_type, paid, expired, count in aggregated_rows:
+            counts = expected.setdefault((event_id, ticket_type), {"total": 0, "paid": 0, "expired": 0})
+            counts["total"] += count
+            if paid:
+                counts["paid"] += count
+            elif expired:
+                counts["expired"] += count
+
+        # the shards of a pool are compared by their sum, the fixed counts go to shard 0
+        counters = {}
+        for counter in cls.query.order_by(cls.shard).all():
+            counters.setdefault((counter.event_id, counter.ticket_type), []).append(counter)
+        drift = []
+        for (event_id, ticket_type), counts in sorted(expected.items()):
+            shards = counters.get((event_id, ticket_type), [])
+            stored = {column: sum(getattr(shard, column) for shard in shards) for column in counts} if shards else None
+            if stored == counts:
+                continue
+            drift.append({"event_id": event_id, "ticket_type": ticket_type, "stored": stored, "expected": counts})
+            if fix:
+                if not shards or shards[0].shard != 0:
+                    shards.insert(0, cls(event_id=event_id, ticket_type=ticket_type))
+                    db.session.add(shards[0])
+                for index, counter in enumerate(shards):
+                    for column, count in counts.items():
+                        setattr(counter, column, count if index == 0 else 0)
+                    counter.version = (counter.version or 0) + 1
+        if fix:
+            db.session.commit()
+        return drift
+
+    # Number of counters and sum of their versions, narrowed by the filters (e.g. event_id=1). Changes whenever one of
+    # the counters does
+    @classmethod
+    def find_version(cls, **filters) -> tuple:
+        count, version = db.session.query(func.count(), func.coalesce(func.sum(cls.version), 0)).select_from(
+            cls).filter_by(**filters).one()
+        return count, version
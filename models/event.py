@@ -1,11 +1,17 @@
 from typing import List
 
-from db import db
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+from db import StagedMixin, db
+from models.counter import CounterModel
 from models.ticket import TicketModel
+from models.ticket_shard import TicketShardModel
+from utils.cache import availability_key, cache, event_key, event_name_key
 from utils.conts import ticket_types
 
 
-class EventModel(db.Model):
+class EventModel(StagedMixin, db.Model):
     """An event that should include its date and time"""
 
     __tablename__ = "events"
@@ -15,15 +21,17 @@ class EventModel(db.Model):
     date = db.Column(db.Date, nullable=False)
     time = db.Column(db.Time, nullable=False)
     tickets = db.relationship("TicketModel", back_populates="event")
+    counters = db.relationship("CounterModel", back_populates="event")
     reservations = db.relationship(
         "ReservationModel", lazy="dynamic", cascade="all, delete-orphan"
     )
 
-    # Adding one ticket model for each category (in this case VIP, Premium and Regular)
+    # Adding one ticket model and its reservation counters for each category (in this case VIP, Premium and Regular)
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         for ticket_type in ticket_types:
             self.tickets.append(TicketModel(ticket_type=ticket_type))
+            self.counters.append(CounterModel(ticket_type=ticket_type))
 
     @classmethod
     def find_by_id(cls, _id: int) -> "EventModel":
@@ -37,19 +45,43 @@ class EventModel(db.Model):
     def find_all(cls) -> List["EventModel"]:
         return cls.query.all()
 
+    # Keyset pagination ordered by id, the tickets of the whole page and their shards are loaded with two extra
+    # queries
+    @classmethod
+    def find_page(cls, after: int, limit: int) -> List["EventModel"]:
+        query = cls.query.options(selectinload(cls.tickets).selectinload(TicketModel.shards))
+        if after is not None:
+            query = query.filter(cls.id > after)
+        return query.order_by(cls.id).limit(limit).all()
+
+    # What the ETag of a page depends on: the number of events in it, the last one and the sum of the versions of their
+    # tickets and ticket shards, in a single aggregate query instead of loading the page
+    @classmethod
+    def find_page_version(cls, after: int, limit: int) -> tuple:
+        page = db.session.query(cls.id)
+        if after is not None:
+            page = page.filter(cls.id > after)
+        page = page.order_by(cls.id).limit(limit).subquery()
+        return db.session.query(
+            func.count(func.distinct(page.c.id)), func.max(page.c.id),
+            func.coalesce(func.sum(TicketModel.version_expression()), 0)
+        ).select_from(page).outerjoin(TicketModel, TicketModel.event_id == page.c.id).outerjoin(
+            TicketShardModel, TicketShardModel.ticket_id == TicketModel.id).one()
+
     def find_by_ticket_type(self, ticket_type: str) -> "TicketModel":
         for ticket in self.tickets:
             if ticket.ticket_type == ticket_type:
                 return ticket
 
+    # Served from the cache, see TicketModel.find_availability
     def check_availability(self, ticket_type: str) -> int:
-        ticket = self.find_by_ticket_type(ticket_type)
-        return ticket.number_available
+        return (TicketModel.find_availability(self.id) or {}).get(ticket_type)
 
     def save_to_db(self) -> None:
-        db.session.add(self)
-        db.session.commit()
+        super().save_to_db()
+        cache.invalidate_on_commit(db.session, event_key(self.id), event_name_key(self.name))
 
     def delete_from_db(self) -> None:
-        db.session.delete(self)
-        db.session.commit()
+        super().delete_from_db()
+        cache.invalidate_on_commit(db.session, event_key(self.id), event_name_key(self.name),
+                                   availability_key(self.id))
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+
+
+class LeaseModel(db.Model):
+    """A named lease held by one process at a time until it expires, used to elect the process running the
+    background work"""
+
+    __tablename__ = "leases"
+
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    # Takes the lease if it is free or expired, or renews it if the holder already has it. Returns whether the holder
+    # has the lease for the next ttl seconds
+    @classmethod
+    def acquire(cls, name: str, holder: str, ttl: float) -> bool:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        acquired = cls.query.filter(cls.name == name).filter(
+            db.or_(cls.holder == holder, cls.expires_at < now)
+        ).update({cls.holder: holder, cls.expires_at: expires_at}, synchronize_session=False)
+        if not acquired and not cls.query.filter_by(name=name).first():
+            db.session.add(cls(name=name, holder=holder, expires_at=expires_at))
+            try:
+                db.session.flush()
+                acquired = 1
+            except IntegrityError:
+                # another process created it first
+                db.session.rollback()
+                return False
+        db.session.commit()
+        return bool(acquired)
+
+    # Gives the lease up straight away, so another process does not have to wait for it to expire
+    @classmethod
+    def release(cls, name: str, holder: str) -> None:
+        cls.query.filter_by(name=name, holder=holder).update(
+            {cls.expires_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
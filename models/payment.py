@@ -0,0 +1,98 @@
+from datetime import datetime
+from typing import List
+from uuid import uuid4
+
+from sqlalchemy.exc import IntegrityError
+
+from db import StagedMixin, db
+
+PENDING = "pending"
+PROCESSING = "processing"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class PaymentModel(StagedMixin, db.Model):
+    """A payment of a reservation, queued on submission and charged later by the payment workers. The idempotency key
+    is unique per reservation, and a reservation can only have one payment that did not fail, so a retried request
+    is never charged twice. Times are stored in UTC. Payments are a ledger, they are kept even if the reservation goes
+    away (no foreign key)"""
+
+    __tablename__ = "payments"
+    __table_args__ = (db.UniqueConstraint("reservation_id", "idempotency_key"),)
+
+    id = db.Column(db.String(50), primary_key=True)
+    reservation_id = db.Column(db.String(50), nullable=False, index=True)
+    idempotency_key = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(10), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)
+    currency = db.Column(db.String(10), nullable=False)
+    token = db.Column(db.String(200), nullable=False)
+    error = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.id = uuid4().hex
+        self.status = PENDING
+        self.created_at = self.updated_at = datetime.utcnow()
+
+    @classmethod
+    def find_by_id(cls, _id: str) -> "PaymentModel":
+        return cls.query.filter_by(id=_id).first()
+
+    # The payment already covering this request: same idempotency key, or any attempt of the reservation that did not
+    # fail
+    @classmethod
+    def find_existing(cls, reservation_id: str, idempotency_key: str) -> "PaymentModel":
+        return cls.query.filter(cls.reservation_id == reservation_id).filter(
+            db.or_(cls.idempotency_key == idempotency_key, cls.status != FAILED)
+        ).order_by(cls.created_at.desc()).first()
+
+    # Queues the payment, unless an existing one already covers the request. Returns the payment and whether it was
+    # created now
+    @classmethod
+    def submit(cls, reservation_id: str, idempotency_key: str, **charge) -> tuple:
+        existing = cls.find_existing(reservation_id, idempotency_key)
+        if existing:
+            return existing, False
+        payment = cls(reservation_id=reservation_id, idempotency_key=idempotency_key, **charge)
+        try:
+            payment.save_to_db()
+        except IntegrityError:
+            # the same request was submitted concurrently
+            db.session.rollback()
+            existing = cls.find_existing(reservation_id, idempotency_key)
+            if not existing:
+                raise
+            return existing, False
+        return payment, True
+
+    # Takes up to batch_size pending payments for this worker, a payment can only move to processing once
+    @classmethod
+    def claim_pending(cls, batch_size: int) -> List[str]:
+        candidates = [row.id for row in db.session.query(cls.id).filter(cls.status == PENDING).order_by(
+            cls.created_at).limit(batch_size).with_for_update(skip_locked=True)]
+        claimed = [_id for _id in candidates if cls.query.filter_by(id=_id, status=PENDING).update(
+            {cls.status: PROCESSING, cls.updated_at: datetime.utcnow()}, synchronize_session=False)]
+        db.session.commit()
+        return claimed
+
+    # Fails a payment that is still processing, e.g. when its worker raised. Nothing is committed here
+    @classmethod
+    def fail(cls, _id: str, error: str) -> bool:
+        return cls.query.filter_by(id=_id, status=PROCESSING).update(
+            {cls.status: FAILED, cls.error: error, cls.updated_at: datetime.utcnow()}, synchronize_session=False
+        ) == 1
+
+    # The payments claimed before the given time and still processing, their worker died while charging them
+    @classmethod
+    def find_stuck(cls, claimed_before: datetime) -> List["PaymentModel"]:
+        return cls.query.filter(cls.status == PROCESSING, cls.updated_at < claimed_before).all()
+
+    def finish(self, status: str, error: str = None) -> None:
+        self.status = status
+        self.error = error
+        self.updated_at = datetime.utcnow()
+        db.session.add(self)
@@ -1,25 +1,117 @@
+from collections import Counter
 from datetime import datetime, timedelta
+from typing import List, Optional
 from uuid import uuid4
 
-from db import db
-from models.event import EventModel
+from sqlalchemy import Integer, cast, func, or_, tuple_
 
+from db import StagedMixin, db
+from models.counter import CounterModel
+from models.ticket import TicketModel
 
-class ReservationModel(db.Model):
+# Filters of the reservation history of a user, see find_page_by_user
+STATUSES = ("paid", "expired", "pending")
+
+
+def remaining_time(paid: bool, expire_at: datetime) -> str:
+    if paid:
+        return "N/A"
+    temp_date = expire_at - datetime.now()
+    if temp_date.days < 0:
+        return "Expired"
+    result = divmod(temp_date.days * 86400 + temp_date.seconds, 60)
+    return "00:{:02d}:{:02d}".format(*result)
+
+
+# Start of the bucket of width seconds of a timestamp column, in seconds since the epoch, computed by the database
+def epoch_bucket(column, width: int):
+    if db.engine.dialect.name == "postgresql":
+        return cast(func.floor(func.extract("epoch", column) / width) * width, Integer)
+    return cast(func.strftime("%s", column), Integer) / width * width
+
+
+# Paid, expired (released, or past its expiration time) and when it expires, from a row with those columns
+def reservation_state(row) -> dict:
+    expired = not row.paid and (row.released or row.expire_at <= datetime.now())
+    return {"id": row.id, "paid": row.paid, "expired": bool(expired), "expire_at": row.expire_at}
+
+
+class ReservationRecord:
+    """Queries and properties shared by the reservations and their archive (see ReservationArchiveModel), both tables
+    have the same columns"""
+
+    @classmethod
+    def find_by_id(cls, _id: str) -> "ReservationModel":
+        return cls.query.filter_by(id=_id).first()
+
+    # Keyset pagination of the reservations of a user, the most recent (latest expire_at) first. after is the last
+    # reservation of the previous page and status one of STATUSES. Every page is a range of the (user_id, expire_at,
+    # id) index
+    @classmethod
+    def find_page_by_user(cls, user_id: int, after: "ReservationModel", limit: int,
+                          status: str = None) -> List["ReservationModel"]:
+        query = cls.query.filter(cls.user_id == user_id)
+        if after is not None:
+            query = query.filter(tuple_(cls.expire_at, cls.id) < tuple_(after.expire_at, after.id))
+        expired = or_(cls.released.is_(True), cls.expire_at <= datetime.now())
+        if status == "paid":
+            query = query.filter(cls.paid.is_(True))
+        elif status == "expired":
+            query = query.filter(cls.paid.is_(False), expired)
+        elif status == "pending":
+            query = query.filter(cls.paid.is_(False), ~expired)
+        return query.order_by(cls.expire_at.desc(), cls.id.desc()).limit(limit).all()
+
+    # Reservations of an event per bucket of width seconds (see epoch_bucket) of one of their timestamps, e.g.
+    # "created_at", within [start, end) and narrowed by the filters, grouped by the database. Returns (bucket start,
+    # ticket type, count) rows
+    @classmethod
+    def count_by_bucket(cls, event_id: int, timestamp: str, start: datetime, end: datetime, width: int,
+                        *filters) -> list:
+        column = getattr(cls, timestamp)
+        bucket = epoch_bucket(column, width).label("bucket")
+        return db.session.query(bucket, cls.ticket_type, func.count(cls.id)).filter(
+            cls.event_id == event_id, column >= start, column < end, *filters
+        ).group_by(bucket, cls.ticket_type).all()
+
+    @property
+    def expired(self) -> bool:
+        return datetime.now() > self.expire_at
+
+    # Time left to pay, computed from expire_at when the reservation is shown to the end user
+    @property
+    def remaining_time(self) -> str:
+        return remaining_time(self.paid, self.expire_at)
+
+
+class ReservationModel(ReservationRecord, StagedMixin, db.Model):
     """A reservation should include which ticket type is intended and for what event, user has to be logged in to
     make a reservation. Each reservation has a unique identifier."""
 
     __tablename__ = "reservations"
+    # The history of a user (find_page_by_user, UserModel.most_recent_reservation) is read in expire_at order, the id
+    # breaks the ties so the pages are read straight from the index. The sales time series of an event are counted on
+    # the ranges of its creation and payment times
+    __table_args__ = (
+        db.Index("ix_reservations_user_id_expire_at", "user_id", "expire_at", "id"),
+        db.Index("ix_reservations_event_id_created_at", "event_id", "created_at"),
+        db.Index("ix_reservations_event_id_paid_at", "event_id", "paid_at"),
+    )
 
     id = db.Column(db.String(50), primary_key=True)
     ticket_type = db.Column(db.String(10))
-    expire_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime)
+    expire_at = db.Column(db.DateTime, nullable=True, index=True)
     paid = db.Column(db.Boolean)
+    paid_at = db.Column(db.DateTime)
+    # The ticket of an expired reservation was given back to the pool
+    released = db.Column(db.Boolean, nullable=False, default=False)
+    # Bumped when the reservation is paid or released, its ETag is derived from it
+    version = db.Column(db.Integer, nullable=False, default=0)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     user = db.relationship("UserModel")
     event_id = db.Column(db.Integer, db.ForeignKey("events.id"))
-    event = db.relationship("EventModel", lazy='subquery')
-    remaining_time = db.Column(db.String(9))
+    event = db.relationship("EventModel")
 
     def __init__(self, user_id: int, event_id: int, ticket_type: str, **kwargs):
         super().__init__(**kwargs)
@@ -27,45 +119,94 @@ class ReservationModel(db.Model):
         self.event_id = event_id
         self.ticket_type = ticket_type
         self.id = uuid4().hex
-        self.expire_at = datetime.now() + timedelta(minutes=15)
+        self.created_at = datetime.now()
+        self.expire_at = self.created_at + timedelta(minutes=15)
         self.paid = False
-        self.remaining_time = '00:15:00'
+        self.released = False
+        self.version = 0
 
-    # Reservation expired, it is needed to restore the ticket to be available to be bought
-    def update_event(self):
-        event = EventModel.find_by_id(self.event_id)
-        ticket = event.find_by_ticket_type(self.ticket_type)
-        ticket.number_available -= 1
+    # Claims the ticket and stages the reservation in the same transaction, returns False if it is sold out. A claim
+    # that failed changed nothing, so there is nothing to roll back (and no cached availability to invalidate)
+    def reserve(self) -> bool:
+        shard = TicketModel.claim(self.event_id, self.ticket_type)
+        if shard is None:
+            return False
+        CounterModel.increment(self.event_id, self.ticket_type, shard, total=1)
         self.save_to_db()
+        return True
 
+    # Group booking, all or nothing: one guarded claim per ticket type (always in the same order, so two groups can not
+    # deadlock) and one bulk insert, committed with the request. Returns the ticket type that ran short, in which case
+    # nothing was reserved, or None once every reservation is staged
     @classmethod
-    def find_by_id(cls, _id: str) -> "ReservationModel":
-        return cls.query.filter_by(id=_id).first()
-
-    @property
-    def expired(self) -> bool:
-        return datetime.now() > self.expire_at
+    def reserve_group(cls, reservations: List["ReservationModel"]) -> Optional[str]:
+        amounts = Counter((reservation.event_id, reservation.ticket_type) for reservation in reservations)
+        for index, ((event_id, ticket_type), amount) in enumerate(sorted(amounts.items())):
+            shard = TicketModel.claim(event_id, ticket_type, amount)
+            if shard is None:
+                if index:
+                    # gives back the pools claimed before this one
+                    db.session.rollback()
+                return ticket_type
+            CounterModel.increment(event_id, ticket_type, shard, total=amount)
+        db.session.bulk_save_objects(reservations)
+        return None
 
-    def update_expiration_time(self):
-        if self.expired and not self.paid:
-            self.remaining_time = "Expired"
-        elif not self.expired and not self.paid:
-            temp_date = self.expire_at - datetime.now()
-            result = divmod(temp_date.days * 86400 + temp_date.seconds, 60)
-            self.remaining_time = "00:{:02d}:{:02d}".format(*result)
-        self.save_to_db()
+    # Number of reservations grouped by event, ticket type, paid and expired flag, computed by the database in a single
+    # GROUP BY query. Criteria and keyword arguments narrow the rows that are counted (e.g. event_id=1)
+    @classmethod
+    def aggregate_counts(cls, *criteria, **filters) -> list:
+        expired = cls.released.label("expired")
+        return db.session.query(
+            cls.event_id, cls.ticket_type, cls.paid, expired, func.count(cls.id).label("count")
+        ).filter(*criteria).filter_by(**filters).group_by(cls.event_id, cls.ticket_type, cls.paid, expired).all()
 
-    def save_to_db(self) -> None:
-        db.session.add(self)
+    # Releases the tickets of up to batch_size unpaid reservations that are past their expiration time. The rows are
+    # locked (skipping the ones locked by another sweeper) and released with one guarded UPDATE per event and ticket
+    # type, so a reservation paid since it was read (SQLite locks nothing on read) is left alone. Only what the UPDATEs
+    # changed goes back to the pools, all in a single transaction. Returns how many reservations were expired
+    @classmethod
+    def expire_batch(cls, batch_size: int) -> int:
+        rows = db.session.query(cls.id, cls.event_id, cls.ticket_type).filter(
+            cls.paid.is_(False), cls.released.is_(False), cls.expire_at <= datetime.now()
+        ).order_by(cls.expire_at).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not rows:
+            db.session.rollback()
+            return 0
+        pools = {}
+        for _id, event_id, ticket_type in rows:
+            pools.setdefault((event_id, ticket_type), []).append(_id)
+        expired = 0
+        for (event_id, ticket_type), ids in pools.items():
+            count = cls.query.filter(cls.id.in_(ids), cls.paid.is_(False), cls.released.is_(False)).update(
+                {cls.released: True, cls.version: cls.version + 1}, synchronize_session=False
+            )
+            if count:
+                shard = TicketModel.release(event_id, ticket_type, count)
+                CounterModel.increment(event_id, ticket_type, shard, expired=count)
+                expired += count
         db.session.commit()
+        return expired
 
-    def delete_from_db(self) -> None:
-        db.session.delete(self)
-        db.session.commit()
+    # State of several reservations (see reservation_state), {id: state} read from a few columns in one query. With
+    # event_id, the reservations of other events are left out
+    @classmethod
+    def find_states(cls, ids, event_id: int = None) -> dict:
+        rows = db.session.query(cls.id, cls.paid, cls.released, cls.expire_at).filter(cls.id.in_(ids))
+        if event_id is not None:
+            rows = rows.filter(cls.event_id == event_id)
+        return {row.id: reservation_state(row) for row in rows}
 
-    def update_ticket_amount(self) -> None:
-        db.session.add(self)
-        if self.remaining_time != "Expired":
-            self.event.find_by_ticket_type(self.ticket_type).number_available += 1
-            self.remaining_time = "Expired"
-        db.session.commit()
+    # Guarded UPDATE, so a reservation released by the expiry sweeper meanwhile is never marked paid. Returns False
+    # (and changes nothing) if it was released or paid already. Nothing is committed here
+    def mark_paid(self) -> bool:
+        cls = type(self)
+        updated = cls.query.filter(cls.id == self.id, cls.paid.is_(False), cls.released.is_(False)).update(
+            {cls.paid: True, cls.paid_at: datetime.now(), cls.version: cls.version + 1}, synchronize_session=False
+        )
+        db.session.expire(self, ["paid", "paid_at", "version", "released"])
+        if not updated:
+            return False
+        CounterModel.increment(self.event_id, self.ticket_type, TicketModel.pick_shard(self.event_id, self.ticket_type),
+                               paid=1)
+        return True
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from sqlalchemy import and_, literal, or_, select
+
+from db import db
+from models.event import EventModel
+from models.reservation import ReservationModel, ReservationRecord
+from models.reservation_rollup import ReservationRollupModel
+
+
+class ReservationArchiveModel(ReservationRecord, db.Model):
+    """Reservations moved out of the reservations table once they can not change anymore: the unpaid ones whose ticket
+    went back to the pool and the ones of past events (see utils.archiver). Same columns, plus when they were archived.
+    There are no foreign keys, like the payments they are a record"""
+
+    __tablename__ = "reservations_archive"
+    __table_args__ = (
+        db.Index("ix_reservations_archive_user_id_expire_at", "user_id", "expire_at", "id"),
+        db.Index("ix_reservations_archive_event_id_created_at", "event_id", "created_at"),
+    )
+
+    id = db.Column(db.String(50), primary_key=True)
+    ticket_type = db.Column(db.String(10))
+    created_at = db.Column(db.DateTime)
+    expire_at = db.Column(db.DateTime)
+    paid = db.Column(db.Boolean)
+    paid_at = db.Column(db.DateTime)
+    released = db.Column(db.Boolean, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    event_id = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    # Unpaid reservations released before the given time
+    @staticmethod
+    def expired_before(moment: datetime):
+        return and_(ReservationModel.paid.is_(False), ReservationModel.released.is_(True),
+                    ReservationModel.expire_at < moment)
+
+    # Paid or released reservations of the events that took place before the given day
+    @staticmethod
+    def past_events_before(moment: datetime):
+        past_events = select([EventModel.id]).where(EventModel.date < moment.date())
+        return and_(ReservationModel.event_id.in_(past_events),
+                    or_(ReservationModel.paid.is_(True), ReservationModel.released.is_(True)))
+
+    # Moves up to batch_size reservations matching the condition to the archive and adds them to the rollups, in a
+    # single transaction. The rows are locked, skipping the ones locked by the sweeper or another archiver. Returns how
+    # many reservations were archived
+    @classmethod
+    def archive_batch(cls, condition, batch_size: int) -> int:
+        ids = [row.id for row in db.session.query(ReservationModel.id).filter(condition).limit(
+            batch_size).with_for_update(skip_locked=True)]
+        if not ids:
+            db.session.rollback()
+            return 0
+        hot = ReservationModel.__table__
+        columns = [column.name for column in hot.columns]
+        db.session.execute(cls.__table__.insert().from_select(
+            columns + ["archived_at"],
+            select([hot.c[name] for name in columns] + [literal(datetime.now(), db.DateTime)]).where(hot.c.id.in_(ids))
+        ))
+        ReservationRollupModel.add(ReservationModel.aggregate_counts(ReservationModel.id.in_(ids)))
+        ReservationModel.query.filter(ReservationModel.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return len(ids)
@@ -0,0 +1,32 @@
+from db import db
+
+
+class ReservationRollupModel(db.Model):
+    """Number of archived reservations per event, ticket type, paid and released flag. Whatever counts the raw
+    reservations (the counters rebuild, the reconciliation) adds these, so archiving does not change any figure"""
+
+    __tablename__ = "reservation_rollups"
+
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ticket_type = db.Column(db.String(10), primary_key=True)
+    paid = db.Column(db.Boolean, primary_key=True)
+    released = db.Column(db.Boolean, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # Adds (event_id, ticket_type, paid, released, count) rows, as returned by ReservationModel.aggregate_counts.
+    # Nothing is committed here, the caller owns the transaction
+    @classmethod
+    def add(cls, rows) -> None:
+        for event_id, ticket_type, paid, released, count in rows:
+            key = dict(event_id=event_id, ticket_type=ticket_type, paid=paid, released=released)
+            updated = cls.query.filter_by(**key).update({cls.count: cls.count + count}, synchronize_session=False)
+            if not updated:
+                db.session.add(cls(count=count, **key))
+        db.session.flush()
+
+    # Same rows as ReservationModel.aggregate_counts, for the archived reservations
+    @classmethod
+    def aggregate_counts(cls, **filters) -> list:
+        return db.session.query(
+            cls.event_id, cls.ticket_type, cls.paid, cls.released.label("expired"), cls.count
+        ).filter_by(**filters).all()
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from db import db
+
+
+class RevokedTokenModel(db.Model):
+    """A JWT token revoked on logout, kept until the token would have expired anyway"""
+
+    __tablename__ = "revoked_tokens"
+
+    jti = db.Column(db.String(36), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    @classmethod
+    def is_revoked(cls, jti: str) -> bool:
+        return db.session.query(
+            cls.query.filter(cls.jti == jti).filter(
+                db.or_(cls.expires_at.is_(None), cls.expires_at > datetime.utcnow())
+            ).exists()
+        ).scalar()
+
+    @classmethod
+    def revoke(cls, jti: str, expires_at: datetime) -> None:
+        db.session.merge(cls(jti=jti, expires_at=expires_at))
+        db.session.flush()
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        deleted = cls.query.filter(cls.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
@@ -1,25 +1,178 @@
-from db import db
+import random
+from typing import Optional
+
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import selectinload
+
+from db import StagedMixin, db
+from models.counter import CounterModel
+from models.ticket_shard import TicketShardModel
+from utils.cache import availability_key, cache, shards_key
 from utils.conts import ticket_numbers
 
 
-class TicketModel(db.Model):
+class TicketModel(StagedMixin, db.Model):
+    """The ticket pool of one type of an event. A hot pool can be sharded (see shard), its tickets are then split
+    across shard_count TicketShardModel rows and number_available only keeps what was not spread yet"""
 
     __tablename__ = "tickets"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     ticket_type = db.Column(db.String(10))
     number_available = db.Column(db.Integer)
+    # Bumped on every change of number_available, the ETag of the event is derived from it
+    version = db.Column(db.Integer, nullable=False, default=0)
+    shard_count = db.Column(db.Integer, nullable=False, default=0)
     event_id = db.Column(db.Integer, db.ForeignKey("events.id"))
     event = db.relationship('EventModel', back_populates="tickets")
+    shards = db.relationship("TicketShardModel", back_populates="ticket", order_by="TicketShardModel.shard",
+                             cascade="all, delete-orphan")
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.ticket_type = kwargs["ticket_type"]
         self.number_available = ticket_numbers[self.ticket_type]
 
-    def save_to_db(self) -> None:
-        db.session.add(self)
-        db.session.commit()
+    # Tickets left in the pool, shards included
+    @property
+    def available(self) -> int:
+        return (self.number_available or 0) + sum(shard.number_available for shard in self.shards)
+
+    # Takes tickets from the pool with a single guarded UPDATE, the row is only touched if there are enough tickets
+    # left, so concurrent reservations can never oversell. A sharded pool starts with a random shard and falls back
+    # to the next ones. Returns the shard the tickets were taken from (0 if the pool is not sharded, its counters
+    # are sharded the same way) or None if there are not enough tickets, in which case nothing was changed. Nothing is
+    # committed here, the caller owns the transaction
+    @classmethod
+    def claim(cls, event_id: int, ticket_type: str, amount: int = 1) -> Optional[int]:
+        shards = cls.find_shards(event_id)
+        shard = cls._claim(event_id, ticket_type, amount, *shards.get(ticket_type, (None, 0)))
+        if shard is None and shards:
+            # the cached shards may be outdated (resharded by another process), checked again before giving up
+            cache.delete(shards_key(event_id))
+            refreshed = cls.find_shards(event_id)
+            if refreshed != shards:
+                shard = cls._claim(event_id, ticket_type, amount, *refreshed.get(ticket_type, (None, 0)))
+        if shard is not None:
+            cache.invalidate_on_commit(db.session, availability_key(event_id))
+        return shard
+
+    @classmethod
+    def _claim(cls, event_id: int, ticket_type: str, amount: int, ticket_id: int, shard_count: int) -> Optional[int]:
+        if shard_count:
+            start = random.randrange(shard_count)
+            for offset in range(shard_count):
+                shard = (start + offset) % shard_count
+                if TicketShardModel.take(ticket_id, shard, amount):
+                    return shard
+        updated = cls.query.filter(
+            cls.event_id == event_id,
+            cls.ticket_type == ticket_type,
+            cls.number_available >= amount,
+        ).update({cls.number_available: cls.number_available - amount, cls.version: cls.version + 1},
+                 synchronize_session=False)
+        if updated == 1:
+            return 0
+        if shard_count and amount > 1:
+            return TicketShardModel.take_spread(ticket_id, amount)
+        return None
+
+    # Gives tickets back to the pool (expired reservations), to a random shard if it is sharded. Returns that shard,
+    # also without committing
+    @classmethod
+    def release(cls, event_id: int, ticket_type: str, amount: int = 1) -> int:
+        cache.invalidate_on_commit(db.session, availability_key(event_id))
+        ticket_id, shard_count = cls.find_shards(event_id).get(ticket_type, (None, 0))
+        if shard_count:
+            shard = random.randrange(shard_count)
+            if TicketShardModel.give_back(ticket_id, shard, amount):
+                return shard
+            # that shard is gone (resharded by another process), the pool row takes the tickets
+            cache.delete(shards_key(event_id))
+        cls.query.filter_by(event_id=event_id, ticket_type=ticket_type).update(
+            {cls.number_available: cls.number_available + amount, cls.version: cls.version + 1},
+            synchronize_session=False
+        )
+        return 0
+
+    # Random shard of the pool, for the counters changed without taking tickets (e.g. a payment)
+    @classmethod
+    def pick_shard(cls, event_id: int, ticket_type: str) -> int:
+        shard_count = cls.find_shards(event_id).get(ticket_type, (None, 0))[1]
+        return random.randrange(shard_count) if shard_count else 0
+
+    # {ticket_type: (ticket id, shard count)} of the event, cached since pools are rarely (re)sharded
+    @classmethod
+    def find_shards(cls, event_id: int) -> dict:
+        def load():
+            rows = db.session.query(cls.ticket_type, cls.id, cls.shard_count).filter(cls.event_id == event_id)
+            return {ticket_type: (ticket_id, shard_count) for ticket_type, ticket_id, shard_count in rows} or None
+        return cache.get_or_set(shards_key(event_id), load, cache.event_ttl) or {}
+
+    # Tickets left of every type of the event with the sum of their versions (shards included), e.g. {"version": 7,
+    # "available": {"VIP": 12, ...}}, served from the cache for at most CACHE_AVAILABILITY_TTL seconds. None if there
+    # are no tickets
+    @classmethod
+    def find_pool(cls, event_id: int) -> Optional[dict]:
+        def load():
+            tickets = cls.query.options(selectinload(cls.shards)).filter_by(event_id=event_id).order_by(
+                cls.id).all()
+            if not tickets:
+                return None
+            return {"version": sum(ticket.version + sum(shard.version for shard in ticket.shards)
+                                   for ticket in tickets),
+                    "available": {ticket.ticket_type: ticket.available for ticket in tickets}}
+        return cache.get_or_set(availability_key(event_id), load, cache.availability_ttl)
+
+    # Version of a row of the tickets outer joined with their shards, summed up it gives the version of the pools (the
+    # same sums as find_pool). The page ETags and the live updates both rely on it
+    @classmethod
+    def version_expression(cls):
+        # a sharded ticket is repeated once per shard, its own version is only added to the sum for the first one
+        first_row = or_(TicketShardModel.shard.is_(None), TicketShardModel.shard == 0)
+        return case([(first_row, cls.version)], else_=0) + func.coalesce(TicketShardModel.version, 0)
+
+    # Versions of the pools of several events at once ({event_id: version}, the same sums as find_pool) in a single
+    # aggregate query, never cached
+    @classmethod
+    def find_versions(cls, event_ids) -> dict:
+        rows = db.session.query(cls.event_id, func.sum(cls.version_expression())).outerjoin(
+            TicketShardModel, TicketShardModel.ticket_id == cls.id
+        ).filter(cls.event_id.in_(event_ids)).group_by(cls.event_id)
+        return {event_id: int(version) for event_id, version in rows}
+
+    @classmethod
+    def find_availability(cls, event_id: int) -> Optional[dict]:
+        pool = cls.find_pool(event_id)
+        return pool["available"] if pool else None
+
+    # Tickets of each shard when total tickets are split evenly across shard_count shards
+    @staticmethod
+    def split(total: int, shard_count: int) -> list:
+        return [total // shard_count + (index < total % shard_count) for index in range(shard_count)]
 
-    def delete_from_db(self) -> None:
-        db.session.delete(self)
-        db.session.commit()
+    # Splits the tickets left in the pool evenly across shard_count shards (0 or 1 puts them back in the pool row),
+    # the counters of the pool get the same shards. The pool row is locked meanwhile, committed by the caller
+    @classmethod
+    def shard(cls, event_id: int, ticket_type: str, shard_count: int) -> Optional["TicketModel"]:
+        ticket = cls.query.filter_by(event_id=event_id, ticket_type=ticket_type).with_for_update().populate_existing(
+        ).first()
+        if ticket is None:
+            return None
+        shard_count = shard_count if shard_count > 1 else 0
+        total = ticket.available
+        existing = {shard.shard: shard for shard in ticket.shards}
+        shards = []
+        for index, number_available in enumerate(cls.split(total, shard_count)):
+            shard = existing.get(index) or TicketShardModel(shard=index, version=0)
+            shard.number_available = number_available
+            shard.version += 1
+            shards.append(shard)
+        # the shards left out are deleted
+        ticket.shards = shards
+        ticket.number_available = 0 if shard_count else total
+        ticket.shard_count = shard_count
+        ticket.version += 1
+        db.session.flush()
+        CounterModel.reshard(event_id, ticket_type, shard_count)
+        cache.invalidate_on_commit(db.session, availability_key(event_id), shards_key(event_id))
+        return ticket
@@ -0,0 +1,53 @@
+from typing import Optional
+
+from db import db
+
+
+class TicketShardModel(db.Model):
+    """A slice of a sharded ticket pool. The tickets of a hot pool are split across several rows, so concurrent
+    reservations update different rows instead of all waiting for the lock of the same one"""
+
+    __tablename__ = "ticket_shards"
+
+    ticket_id = db.Column(db.Integer, db.ForeignKey("tickets.id"), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    number_available = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped on every change, the ETag of the event includes it
+    version = db.Column(db.Integer, nullable=False, default=0)
+    ticket = db.relationship("TicketModel", back_populates="shards")
+
+    # Guarded UPDATE of one shard, like TicketModel.claim. Nothing is committed here
+    @classmethod
+    def take(cls, ticket_id: int, shard: int, amount: int) -> bool:
+        updated = cls.query.filter(
+            cls.ticket_id == ticket_id, cls.shard == shard, cls.number_available >= amount
+        ).update({cls.number_available: cls.number_available - amount, cls.version: cls.version + 1},
+                 synchronize_session=False)
+        return updated == 1
+
+    @classmethod
+    def give_back(cls, ticket_id: int, shard: int, amount: int) -> bool:
+        updated = cls.query.filter_by(ticket_id=ticket_id, shard=shard).update(
+            {cls.number_available: cls.number_available + amount, cls.version: cls.version + 1},
+            synchronize_session=False
+        )
+        return updated == 1
+
+    # Takes amount tickets spread over several shards, once no single shard has enough. Every shard of the pool is
+    # locked, which is fine since this only happens for group reservations at the end of a sale. Returns the shard
+    # the most tickets were taken from, or None (and nothing is taken) if the shards do not have enough altogether
+    @classmethod
+    def take_spread(cls, ticket_id: int, amount: int) -> Optional[int]:
+        shards = cls.query.filter_by(ticket_id=ticket_id).order_by(cls.shard).with_for_update().populate_existing(
+        ).all()
+        if sum(shard.number_available for shard in shards) < amount:
+            return None
+        largest = max(shards, key=lambda shard: shard.number_available).shard
+        for shard in shards:
+            taken = min(shard.number_available, amount)
+            if taken:
+                shard.number_available -= taken
+                shard.version += 1
+                amount -= taken
+        db.session.flush()
+        return largest
@@ -1,8 +1,9 @@
-from db import db
+from db import StagedMixin, db
 from models.reservation import ReservationModel
+from models.reservation_archive import ReservationArchiveModel
 
 
-class UserModel(db.Model):
+class UserModel(StagedMixin, db.Model):
     __tablename__ = "users"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -12,11 +13,14 @@ class UserModel(db.Model):
         "ReservationModel", lazy="dynamic", cascade="all, delete-orphan"
     )
 
-    # Internal, not used on the API
+    # Internal, not used on the API. A LIMIT 1 lookup on the (user_id, expire_at, id) index of the reservations and
+    # another one on the same index of the archive
     @property
     def most_recent_reservation(self) -> "ReservationModel":
         # ordered by expiration time (in descending order)
-        return self.confirmation.order_by(db.desc(ReservationModel.expire_at)).first()
+        pages = [model.find_page_by_user(self.id, None, 1) for model in (ReservationModel, ReservationArchiveModel)]
+        candidates = [page[0] for page in pages if page]
+        return max(candidates, key=lambda reservation: (reservation.expire_at, reservation.id), default=None)
 
     @classmethod
     def find_by_username(cls, username: str) -> "UserModel":
@@ -26,10 +30,7 @@ class UserModel(db.Model):
     def find_by_id(cls, _id: int) -> "UserModel":
         return cls.query.filter_by(id=_id).first()
 
-    def save_to_db(self) -> None:
-        db.session.add(self)
-        db.session.commit()
-
+    # The archived reservations have no foreign key to cascade from, they go with the user too
     def delete_from_db(self) -> None:
-        db.session.delete(self)
-        db.session.commit()
+        ReservationArchiveModel.query.filter_by(user_id=self.id).delete(synchronize_session=False)
+        super().delete_from_db()
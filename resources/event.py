@@ -1,30 +1,89 @@
-from flask import request
+from flask import Response, current_app, request
 from flask_restful import Resource
 
 from models.event import EventModel
+from models.ticket import TicketModel
 from schemas.event import EventSchema
+from utils.cache import cache, event_key, event_name_key
+from utils.etag import conditional
+from utils.serializers import compile_dump
+from utils.event_import import FORMATS, import_events
+from utils.live import LiveBusy, live_hub
 from utils.validator import validate_request
 
 event_schema = EventSchema()
 event_list_schema = EventSchema(many=True)
+event_metadata_schema = EventSchema(exclude=("tickets",))
+# Same output as the dumps of the schemas above, see utils.serializers
+dump_events = compile_dump(event_list_schema)
+dump_event_metadata = compile_dump(event_metadata_schema)
+# Keys in the order event_schema dumps them, so the cached response is the same
+EVENT_KEYS = [field.data_key or name for name, field in event_schema.fields.items() if not field.load_only]
+TICKET_KEYS = [field.data_key or name for name, field in event_schema.fields["tickets"].schema.fields.items()
+               if not field.load_only]
+
+
+# The event without its tickets, cached for CACHE_EVENT_TTL seconds since events almost never change
+def event_snapshot(event_id: int) -> dict:
+    def load():
+        event = EventModel.find_by_id(event_id)
+        return dump_event_metadata(event) if event else None
+    return cache.get_or_set(event_key(event_id), load, cache.event_ttl)
+
+
+# Same response as dumping the event, the availability of its tickets is cached separately and for a much shorter time
+def event_response(event_id: int) -> dict:
+    snapshot = event_snapshot(event_id)
+    if snapshot is None:
+        return None
+    availability = TicketModel.find_availability(event_id) or {}
+    tickets = [ordered({"ticket_type": ticket_type, "number_available": number_available}, TICKET_KEYS)
+               for ticket_type, number_available in availability.items()]
+    return ordered(dict(snapshot, tickets=tickets), EVENT_KEYS)
+
+
+def ordered(data: dict, keys: list) -> dict:
+    return {key: data[key] for key in keys if key in data}
+
+
+def find_event_id(name: str) -> int:
+    def load():
+        event = EventModel.find_by_name(name)
+        return event.id if event else None
+    return cache.get_or_set(event_name_key(name), load, cache.event_ttl)
+
+
+# The event only changes with the availability of its tickets
+def event_etag(**kwargs):
+    event_id = kwargs['_id'] if '_id' in kwargs else find_event_id(kwargs['name'])
+    if event_id is None or event_snapshot(event_id) is None:
+        return None
+    pool = TicketModel.find_pool(event_id)
+    return 'event', event_id, pool['version'] if pool else None
+
+
+def event_page_etag():
+    limit = request.args.get('limit', current_app.config['EVENTS_PAGE_SIZE'], type=int)
+    after = request.args.get('after', type=int)
+    if not 0 < limit <= current_app.config['EVENTS_MAX_PAGE_SIZE']:
+        return None
+    return ('events', after, limit) + tuple(EventModel.find_page_version(after, limit + 1))
 
 
 class Event(Resource):
     @classmethod
+    @conditional(event_etag)
     def get(cls, **kwargs):
         if '_id' in kwargs:
             # get occurrence by id
-            event = EventModel.find_by_id(kwargs['_id'])
-            if event:
-                return event_schema.dump(event), 200
-            else:
-                return {"message": "Event not found."}, 404
+            event = event_response(kwargs['_id'])
+        else:
+            event_id = find_event_id(kwargs['name'])
+            event = event_response(event_id) if event_id is not None else None
+        if event:
+            return event, 200
         else:
-            event = EventModel.find_by_name(kwargs['name'])
-            if event:
-                return event_schema.dump(event), 200
-            else:
-                return {"message": "Event not found."}, 404
+            return {"message": "Event not found."}, 404
 
     @classmethod
     def post(cls):
@@ -35,12 +94,59 @@ class Event(Resource):
         event = event_schema.load(event_json)
         try:
             event.save_to_db()
+            # hot pools are split across INVENTORY_SHARDS shards from the start
+            if current_app.config['INVENTORY_SHARDS'] > 1:
+                for ticket in event.tickets:
+                    TicketModel.shard(event.id, ticket.ticket_type, current_app.config['INVENTORY_SHARDS'])
         except:
             return {"message": "Internal server error. Failed to create occurrence."}, 500
         return event_schema.dump(event), 201
 
 
 class EventList(Resource):
+    # One page of events, ?after=<id of the last event received> gives the next one
     @classmethod
+    @conditional(event_page_etag)
     def get(cls):
-        return {"events": event_list_schema.dump(EventModel.find_all())}, 200
+        limit = request.args.get('limit', current_app.config['EVENTS_PAGE_SIZE'], type=int)
+        after = request.args.get('after', type=int)
+        if not 0 < limit <= current_app.config['EVENTS_MAX_PAGE_SIZE']:
+            return {'message': 'The limit has to be between 1 and {}.'.format(
+                current_app.config['EVENTS_MAX_PAGE_SIZE'])}, 400
+        # Fetching one more event tells if there is a next page
+        events = EventModel.find_page(after, limit + 1)
+        next_cursor = events[limit - 1].id if len(events) > limit else None
+        return {"events": dump_events(events[:limit]), "next": next_cursor}, 200
+
+
+class EventStream(Resource):
+    # Server-Sent Events with the availability of the event and the state of the reservations given as
+    # ?reservation=<id> (repeated for several), sent as they change instead of being polled (see utils.live)
+    @classmethod
+    def get(cls, _id: int):
+        if not live_hub.enabled or event_snapshot(_id) is None:
+            return {"message": "Event not found."}, 404
+        reservation_ids = request.args.getlist('reservation')
+        if len(reservation_ids) > current_app.config['LIVE_MAX_RESERVATIONS']:
+            return {'message': 'At most {} reservations can be followed.'.format(
+                current_app.config['LIVE_MAX_RESERVATIONS'])}, 400
+        try:
+            stream = live_hub.subscribe(_id, reservation_ids)
+        except LiveBusy as e:
+            return {'message': str(e)}, 503, {'Retry-After': str(live_hub.retry)}
+        # proxies must not buffer the stream
+        return Response(stream, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class EventImport(Resource):
+    # Imports a JSONL or CSV file of events (?format=jsonl|csv), sent as the "file" of a form or as the raw body
+    @classmethod
+    def post(cls):
+        file_format = request.args.get('format', 'jsonl').lower()
+        if file_format not in FORMATS:
+            return {'message': 'The format has to be one of {}.'.format(', '.join(FORMATS))}, 400
+        stream = request.files['file'].stream if 'file' in request.files else request.stream
+        report = import_events(stream, file_format, current_app.config['EVENT_IMPORT_CHUNK_SIZE'],
+                               current_app.config['EVENT_IMPORT_MAX_ERRORS'], current_app.config['INVENTORY_SHARDS'])
+        return report, 200
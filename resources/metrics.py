@@ -0,0 +1,11 @@
+from flask import Response
+from flask_restful import Resource
+
+from utils.metrics import metrics
+
+
+class Metrics(Resource):
+    # Prometheus text format, not JSON
+    @classmethod
+    def get(cls):
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
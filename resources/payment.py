@@ -0,0 +1,16 @@
+from flask_restful import Resource
+
+from models.payment import PaymentModel
+from schemas.payment import PaymentSchema
+
+payment_schema = PaymentSchema()
+
+
+class Payment(Resource):
+    # Status of a payment submitted for a reservation (pending, processing, succeeded or failed)
+    @classmethod
+    def get(cls, payment_id: str):
+        payment = PaymentModel.find_by_id(payment_id)
+        if not payment:
+            return {"message": "That payment was not found on the system."}, 404
+        return payment_schema.dump(payment), 200
@@ -1,87 +1,45 @@
-from collections import namedtuple
+from uuid import uuid4
 
-from flask import request
+from flask import current_app, request
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from flask_restful import Resource
 
 from models.event import EventModel
+from models.payment import PaymentModel
 from models.reservation import ReservationModel
+from models.reservation_archive import ReservationArchiveModel
 from schemas.reservation import ReservationSchema
-from apscheduler.schedulers.background import BackgroundScheduler
-from dotenv import load_dotenv
+from utils.admission import AdmissionBusy, admission_gate
 from utils.conts import ticket_types
+from utils.etag import conditional_response
+from utils.serializers import compile_dump
 from utils.validator import validate_request
 from utils.verify_ticket_type import valid_ticket_type, convert_ticket_type
 
-load_dotenv(".env", verbose=True)
-from config import SQLALCHEMY_DATABASE_URI
-
 reservation_schema = ReservationSchema()
+dump_reservation = compile_dump(reservation_schema)
 
-# Configuring the scheduler
-
-scheduler = BackgroundScheduler({
-    'apscheduler.jobstores.default': {
-        'type': 'sqlalchemy',
-        'url': SQLALCHEMY_DATABASE_URI,
-        'tablename': 'jobs'
-    },
-    'apscheduler.executors.default': {
-        'class': 'apscheduler.executors.pool:ThreadPoolExecutor',
-        'max_workers': '100'
-    },
-    'apscheduler.executors.processpool': {
-        'type': 'processpool',
-        'max_workers': '5'
-    },
-    'apscheduler.job_defaults.coalesce': 'false',
-    'apscheduler.job_defaults.max_instances': '3',
-    'apscheduler.timezone': 'Europe/London',
-})
-
-# Starting the scheduler
-if not scheduler.running:
-    scheduler.start()
-
-
-class CardError(Exception):
-    pass
-
-
-class PaymentError(Exception):
-    pass
-
-
-class CurrencyError(Exception):
-    pass
-
-
-PaymentResult = namedtuple('PaymentResult', ('amount', 'currency'))
+PAYMENT_FIELDS = {'amount', 'token', 'currency'}
+SERVER_BUSY = "The tickets are in high demand, please try again in a moment."
 
 
-class PaymentGateway:
-    supported_currencies = ('EUR', 'PLN',)
-
-    def charge(self, amount: int, token: str, currency: str = 'EUR'):
-        if token == 'card_error':
-            raise CardError("Your card has been declined")
-        elif token == 'payment_error':
-            raise PaymentError("Something went wrong with your transaction")
-        elif currency not in self.supported_currencies:
-            raise CurrencyError(f"Currency {currency} not supported")
-        else:
-            return {'PaymentResult': PaymentResult(amount, currency)._asdict()}, 200
+def sold_out_message(ticket_type: str) -> tuple:
+    return {'message': 'We are sorry to inform that {} tickets are sold out.'.format(ticket_type)}, 200
 
 
 class Reservation(Resource):
-    # Retrieve a reservation by ID, and update the expiration time to show to the end user
+    # Retrieve a reservation by ID, archived ones included, the remaining time is computed when it is dumped (read
+    # only). Only paid or expired reservations get an ETag, the countdown of the others changes every second
     @classmethod
     def get(cls, reservation_id: str):
-        reservation = ReservationModel.find_by_id(reservation_id)
+        reservation = ReservationModel.find_by_id(reservation_id) or ReservationArchiveModel.find_by_id(reservation_id)
         if not reservation:
             return {"message": "That reservation was not found on the system."}, 404
-        reservation.update_expiration_time()
-        return reservation_schema.dump(reservation), 200
+        remaining = reservation.remaining_time
+        if not reservation.paid and not reservation.released and remaining != "Expired":
+            return dump_reservation(reservation), 200
+        return conditional_response((reservation.id, reservation.version, remaining),
+                                    lambda: (dump_reservation(reservation), 200))
 
     # User needs to be logged in to do a reservation, hence the jwt_required decorator
     @jwt_required
@@ -94,23 +52,23 @@ class Reservation(Resource):
             reservation_json['ticket_type'] = convert_ticket_type(reservation_json['ticket_type'])
             user_id = get_jwt_identity()
             reservation_json['user_id'] = user_id
-            event = EventModel.find_by_id(reservation_json['event_id'])
-            if event:
-                if not event.check_availability(reservation_json['ticket_type']):
-                    return {'message': 'We are sorry to inform that {} '
-                            'tickets are sold out.'.format(reservation_json['ticket_type'])}, 200
-            else:
-                return {'message': 'That is not a valid event'}, 404
             if not validate_request(reservation_json, ReservationModel):
                 return {'message': 'Request invalid, please re-check your parameters.'}, 400
             # Unpack the request into a new reservation model
             reservation = ReservationModel(**reservation_json)
-            # It is needed to remove one available ticket, since now it is reserved
-            reservation.update_event()
-            reservation.save_to_db()
-            scheduler.add_job(reservation.update_ticket_amount,
-                              'date', id=reservation.id, run_date=reservation.expire_at)
-            return {"message": "Your reservation was successful."}, 201
+            if admission_gate.is_sold_out(reservation.event_id, reservation.ticket_type):
+                return sold_out_message(reservation.ticket_type)
+            try:
+                with admission_gate.admit(reservation.event_id, reservation.ticket_type):
+                    # One available ticket is claimed and the reservation stored in the same transaction
+                    if not reservation.reserve():
+                        if not EventModel.find_by_id(reservation.event_id):
+                            return {'message': 'That is not a valid event'}, 404
+                        admission_gate.mark_sold_out(reservation.event_id, reservation.ticket_type)
+                        return sold_out_message(reservation.ticket_type)
+            except AdmissionBusy as e:
+                return {'message': SERVER_BUSY, 'position': e.position}, 503, {'Retry-After': '1'}
+            return {"message": "Your reservation was successful.", "reservation_id": reservation.id}, 201
         else:
             # Here the user is trying to pay for a reservation, since an ID was passed in the request
             reservation_json['reservation_id'] = kwargs['reservation_id']
@@ -119,32 +77,66 @@ class Reservation(Resource):
                 if reservation.expired:
                     return {'message': 'Sorry, that reservation is already expired. Please make a new reservation and '
                                        'pay after.'}, 400
-                reservation_json['reservation'] = reservation
                 # Popping keys from the dictionary, since this dict will be passed on later to our payment gateway
                 reservation_json.pop('reservation_id', None)
-                return self.pay(**reservation_json)
+                return self.pay(reservation, **reservation_json)
             else:
                 return {"message": "That reservation was not found on the system."}, 404
 
+    # The payment is only queued here and charged by the payment workers, its status can be followed on
+    # /payment/<payment_id>. Retrying with the same Idempotency-Key header returns the same payment instead of charging
+    # again. Without it every request is a new attempt, still deduplicated by any payment of the reservation that did
+    # not fail, so a declined card can be retried
     @staticmethod
-    def pay(**kwargs):
-        reservation = kwargs['reservation']
-        kwargs.pop('reservation', None)
-        payment_gateway = PaymentGateway()
-        try:
-            result = payment_gateway.charge(**kwargs)
-            if result[1] == 200:
-                reservation.paid = True
-                reservation.remaining_time = "N/A"
-                reservation.save_to_db()
-            return result
-        except CardError as e:
-            return {"message": str(e)}, 400
-        except PaymentError as e:
-            return {"message": str(e)}, 400
-        except CurrencyError as e:
-            return {"message": str(e)}, 400
-        except:
-            return {"message": "Internal server error. Failed to process payment. "}, 500
-
-
+    def pay(reservation, **kwargs):
+        if not set(kwargs.keys()).issubset(PAYMENT_FIELDS) or not isinstance(kwargs.get('amount'), int) \
+                or not isinstance(kwargs.get('token'), str) or not isinstance(kwargs.get('currency', 'EUR'), str):
+            return {'message': 'Request invalid, please re-check your parameters.'}, 400
+        kwargs.setdefault('currency', 'EUR')
+        idempotency_key = request.headers.get('Idempotency-Key') or uuid4().hex
+        payment, _ = PaymentModel.submit(reservation.id, idempotency_key[:100], **kwargs)
+        return {"message": "Your payment was submitted.", "payment_id": payment.id, "status": payment.status}, \
+            202, {"Location": "/payment/{}".format(payment.id)}
+
+
+class GroupReservation(Resource):
+    # Reserves several tickets of one or more types for an event at once, e.g. {"event_id": 1, "tickets": {"VIP": 2}}.
+    # Either every ticket is reserved or none is
+    @jwt_required
+    def post(self):
+        reservation_json = request.get_json()
+        if not isinstance(reservation_json, dict) or set(reservation_json.keys()) != {'event_id', 'tickets'}:
+            return {'message': 'Request invalid, please re-check your parameters.'}, 400
+        event_id, tickets = reservation_json['event_id'], reservation_json['tickets']
+        if not isinstance(event_id, int) or not isinstance(tickets, dict) or not tickets:
+            return {'message': 'Request invalid, please re-check your parameters.'}, 400
+        amounts = {}
+        for ticket_type, amount in tickets.items():
+            if not valid_ticket_type(ticket_type):
+                return {'message': 'That is not a valid ticket type. '
+                                   'Please choose between {}, {} or {}.'.format(*ticket_types)}, 400
+            if not isinstance(amount, int) or amount < 1:
+                return {'message': 'The number of {} tickets has to be a positive integer.'.format(ticket_type)}, 400
+            ticket_type = convert_ticket_type(ticket_type)
+            amounts[ticket_type] = amounts.get(ticket_type, 0) + amount
+        max_tickets = current_app.config['GROUP_RESERVATION_MAX_TICKETS']
+        if sum(amounts.values()) > max_tickets:
+            return {'message': 'A group reservation can include at most {} tickets.'.format(max_tickets)}, 400
+
+        user_id = get_jwt_identity()
+        reservations = [ReservationModel(user_id=user_id, event_id=event_id, ticket_type=ticket_type)
+                        for ticket_type, amount in amounts.items() for _ in range(amount)]
+        # pools already known to be sold out are answered without reaching the database
+        sold_out = next((ticket_type for ticket_type in amounts if admission_gate.is_sold_out(event_id, ticket_type)),
+                        None)
+        if sold_out:
+            return {'message': 'We are sorry to inform that there are not enough {} '
+                               'tickets left.'.format(sold_out)}, 200
+        sold_out = ReservationModel.reserve_group(reservations)
+        if sold_out:
+            if not EventModel.find_by_id(event_id):
+                return {'message': 'That is not a valid event'}, 404
+            return {'message': 'We are sorry to inform that there are not enough {} '
+                               'tickets left.'.format(sold_out)}, 200
+        return {"message": "Your reservations were successful.",
+                "reservations": [reservation.id for reservation in reservations]}, 201
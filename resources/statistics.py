@@ -1,17 +1,61 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, request
 from flask_restful import Resource
+from sqlalchemy import func
 
+from db import db
+from models.counter import CounterModel
 from models.event import EventModel
-from models.reservation import ReservationModel
-from schemas.reservation import ReservationSchema
+from resources.event import event_snapshot
 
 from utils.conts import ticket_types
+from utils.etag import conditional
+from utils.timeseries import SERIES, sales_timeseries
 from utils.verify_ticket_type import valid_ticket_type, convert_ticket_type
 
-reservation_list_schema = ReservationSchema(many=True)
+EMPTY_TALLY = {'paid': 0, 'expired': 0, 'not_expired': 0}
+
+
+# YYYY-MM-DDTHH:MM[:SS[.ffffff]] with an optional Z or [+-]HH:MM offset, a "+" left unencoded in the query string
+# arrives as a space
+ISO_TIME = re.compile(r"^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?"
+                      r"(?:(Z)|([+\- ])(\d{2}):?(\d{2}))?$")
+
+
+# ISO 8601 time of the query string as a naive local time, like the timestamps of the reservations. The offset is
+# parsed here, marshmallow drops it unless python-dateutil is installed. Raises ValueError if it is not valid
+def parse_time(value: str) -> datetime:
+    match = ISO_TIME.match(value)
+    if match is None:
+        raise ValueError("Not an ISO 8601 time: {}".format(value))
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes = match.groups()
+    moment = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+                      int((fraction or "0").ljust(6, "0")))
+    if not utc and not sign:
+        return moment
+    offset = timedelta(hours=int(offset_hours or 0), minutes=int(offset_minutes or 0))
+    return moment.replace(tzinfo=timezone(-offset if sign == "-" else offset)).astimezone().replace(tzinfo=None)
+
+
+# The statistics only change with the counters they are computed from (and the events listed)
+def statistics_etag(**kwargs):
+    if 'event_id' in kwargs:
+        count, version = CounterModel.find_version(event_id=kwargs['event_id'])
+        return ('event', kwargs['event_id'], count, version) if count else None
+    elif 'ticket_type' in kwargs:
+        if not valid_ticket_type(kwargs['ticket_type']):
+            return None
+        ticket_type = convert_ticket_type(kwargs['ticket_type'])
+        return ('tickets', ticket_type) + CounterModel.find_version(ticket_type=ticket_type)
+    events = db.session.query(func.count(EventModel.id), func.max(EventModel.id)).one()
+    return ('events',) + tuple(events) + CounterModel.find_version()
 
 
 class Statistics(Resource):
     @classmethod
+    @conditional(statistics_etag)
     def get(cls, **kwargs):
         # Statistics for a specific event
         if 'event_id' in kwargs:
@@ -19,68 +63,91 @@ class Statistics(Resource):
             if not event:
                 return {"message": "Event not found."}, 404
             else:
-                return cls.build_event_response(event), 200
+                tallies = cls.tally(CounterModel.query.filter_by(event_id=event.id))
+                return cls.build_event_response(event.id, tallies), 200
         # Statistics for a specific ticket type
         elif 'ticket_type' in kwargs:
             if not valid_ticket_type(kwargs['ticket_type']):
                 return {'message': 'That is not a valid ticket type. '
                                    'Please choose between {}, {} or {}.'.format(*ticket_types)}, 400
             kwargs['ticket_type'] = convert_ticket_type(kwargs['ticket_type'])
-            return cls.build_ticket_response(kwargs['ticket_type'])
+            tallies = cls.tally(CounterModel.query.filter_by(ticket_type=kwargs['ticket_type']))
+            return cls.build_ticket_response(kwargs['ticket_type'], tallies)
         else:
             # Statistics for every event in the database
+            tallies = cls.tally(CounterModel.query)
             response = {'events': []}
-            for event in EventModel.query.all():
-                response['events'].append({event.name: {'id': event.id, **cls.build_event_response(event)}})
+            for event_id, name in db.session.query(EventModel.id, EventModel.name).order_by(EventModel.id):
+                response['events'].append({name: {'id': event_id, **cls.build_event_response(event_id, tallies)}})
             return response
 
+    # Reads the counters into {(event_id, ticket_type): {'paid': n, 'expired': n, 'not_expired': n}}, summing the
+    # shards of each pool
     @staticmethod
-    def build_event_response(event):
-        response = {'reservations': {'total': ReservationModel.query.filter_by(event_id=event.id).count()
-                                     }}
-        details = {}
+    def tally(counters):
+        tallies = {}
+        for counter in counters:
+            tally = tallies.setdefault((counter.event_id, counter.ticket_type), dict(EMPTY_TALLY))
+            tally['paid'] += counter.paid
+            tally['expired'] += counter.expired
+            tally['not_expired'] += counter.total - counter.paid - counter.expired
+        return tallies
+
+    @staticmethod
+    def build_details(tally):
+        return {'total': tally['paid'] + tally['expired'] + tally['not_expired'],
+                'explicit':
+                    {
+                        'paid': tally['paid'],
+                        'not_paid':
+                            {
+                                'expired': tally['expired'],
+                                'not_expired': tally['not_expired']
+                            }
+                    }}
 
+    @classmethod
+    def build_event_response(cls, event_id, tallies):
+        details = {}
         for ticket_type in ticket_types:
-            total_reservations = ReservationModel.query.filter_by(ticket_type=ticket_type).\
-                filter_by(event_id=event.id).count()
-            paid_reservations = list(filter(lambda x: x.paid and getattr(x, 'ticket_type') == ticket_type
-                                            and getattr(x, 'event_id') == event.id,
-                                            ReservationModel.query.all()))
-            not_paid_reservations = list(filter(lambda x: not x.paid and getattr(x, 'ticket_type') == ticket_type
-                                                and getattr(x, 'event_id') == event.id,
-                                                ReservationModel.query.all()))
-            expired_reservations = list(filter(lambda x: getattr(x, 'remaining_time') == "Expired",
-                                               not_paid_reservations))
-            details[ticket_type] = {'total': total_reservations,
-                                    'explicit':
-                                        {
-                                            'paid': len(paid_reservations),
-                                            'not_paid':
-                                                {
-                                                 'expired': len(expired_reservations),
-                                                 'not_expired': len(not_paid_reservations) - len(expired_reservations)
-                                                 }
-                                        }}
-        response['reservations']['details'] = details
-        return response
+            details[ticket_type] = cls.build_details(tallies.get((event_id, ticket_type), EMPTY_TALLY))
+        return {'reservations': {'total': sum(detail['total'] for detail in details.values()),
+                                 'details': details}}
 
-    @staticmethod
-    def build_ticket_response(ticket_type):
-        total_reservations = ReservationModel.query.filter_by(ticket_type=ticket_type).count()
-        paid_reservations = list(filter(lambda x: x.paid and getattr(x, 'ticket_type') == ticket_type,
-                                        ReservationModel.query.all()))
-        not_paid_reservations = list(filter(lambda x: not x.paid and getattr(x, 'ticket_type') == ticket_type,
-                                            ReservationModel.query.all()))
-        expired_reservations = list(filter(lambda x: getattr(x, 'remaining_time') == "Expired",
-                                           not_paid_reservations))
-        details = {'total': total_reservations,
-                                'explicit':
-                                    {
-                                        'paid': len(paid_reservations),
-                                        'not_paid':
-                                            {
-                                                'expired': len(expired_reservations),
-                                                'not_expired': len(not_paid_reservations) - len(expired_reservations)
-                                            }
-                                    }}
-        return {ticket_type: details}
+    @classmethod
+    def build_ticket_response(cls, ticket_type, tallies):
+        tally = dict(EMPTY_TALLY)
+        for (_, tallied_type), counts in tallies.items():
+            if tallied_type == ticket_type:
+                for key, count in counts.items():
+                    tally[key] += count
+        return {ticket_type: cls.build_details(tally)}
+
+
+class StatisticsTimeseries(Resource):
+    # Reservations, payments and expiries of the event per ticket type and bucket of ?bucket=<seconds>, between ?from=
+    # and ?to= (ISO 8601 local times, the last TIMESERIES_RANGE seconds by default). See utils.timeseries
+    @classmethod
+    def get(cls, event_id: int):
+        if event_snapshot(event_id) is None:
+            return {"message": "Event not found."}, 404
+        width = request.args.get('bucket', current_app.config['TIMESERIES_BUCKET'], type=int)
+        try:
+            end = parse_time(request.args['to']) if 'to' in request.args else datetime.now()
+            if 'from' in request.args:
+                start = parse_time(request.args['from'])
+            else:
+                start = end - timedelta(seconds=current_app.config['TIMESERIES_RANGE'])
+        except ValueError:
+            return {'message': 'The from and to times have to be in ISO 8601 format.'}, 400
+        if width <= 0 or start >= end:
+            return {'message': 'The bucket has to be positive and from earlier than to.'}, 400
+        if (end - start).total_seconds() / width > current_app.config['TIMESERIES_MAX_BUCKETS']:
+            return {'message': 'At most {} buckets can be requested.'.format(
+                current_app.config['TIMESERIES_MAX_BUCKETS'])}, 400
+        buckets = sales_timeseries(event_id, start, end, width, current_app.config['TIMESERIES_CLOSE_DELAY'],
+                                   current_app.config['TIMESERIES_CACHE_TTL'])
+        return {'event_id': event_id,
+                'bucket': width,
+                'buckets': [dict({series: bucket[series] for series in SERIES}, start=bucket['start'].isoformat())
+                            for bucket in buckets]}, 200
@@ -1,6 +1,6 @@
 from datetime import timedelta
 
-from flask import request
+from flask import current_app, request
 from flask_jwt_extended import (
     create_access_token,
     create_refresh_token,
@@ -12,9 +12,13 @@ from flask_jwt_extended import (
 from flask_restful import Resource
 
 from blacklist import BLACKLIST
+from models.reservation import STATUSES, ReservationModel
+from models.reservation_archive import ReservationArchiveModel
 from models.user import UserModel
+from schemas.reservation import ReservationSchema
 from schemas.user import UserSchema
-from utils.password_manager import encrypt_password, check_encrypted_password
+from utils.password_manager import HashingBusy, password_hasher
+from utils.serializers import compile_dump
 from utils.validator import validate_request
 
 USER_ALREADY_EXISTS = "A user with that username already exists."
@@ -23,8 +27,10 @@ USER_NOT_FOUND = "User not found."
 USER_DELETED = "User deleted."
 INVALID_CREDENTIALS = "Invalid credentials!"
 USER_LOGGED_OUT = "{} successfully logged out."
+SERVER_BUSY = "The server is busy, please try again in a moment."
 
 user_schema = UserSchema()
+dump_reservations = compile_dump(ReservationSchema(many=True))
 
 
 class UserRegister(Resource):
@@ -33,12 +39,15 @@ class UserRegister(Resource):
         user_json = request.get_json()
         if not validate_request(user_json, UserModel):
             return {'message': 'Request invalid, please re-check your parameters.'}, 400
-        user_json['password'] = encrypt_password(user_json['password'])
         user = user_schema.load(user_json)
 
         if UserModel.find_by_username(user.username):
             return {"message": USER_ALREADY_EXISTS}, 400
 
+        try:
+            user.password = password_hasher.hash(user.password)
+        except HashingBusy:
+            return {"message": SERVER_BUSY}, 503, {"Retry-After": "1"}
         user.save_to_db()
 
         return {"message": CREATED_SUCCESSFULLY}, 201
@@ -64,6 +73,36 @@ class User(Resource):
         return {"message": USER_DELETED}, 200
 
 
+class UserReservations(Resource):
+    # Reservation history of a user, the most recent first. ?after=<id of the last reservation received> gives the next
+    # page and ?status=paid|expired|pending only lists those
+    @classmethod
+    def get(cls, user_id: int):
+        limit = request.args.get('limit', current_app.config['USER_RESERVATIONS_PAGE_SIZE'], type=int)
+        status = request.args.get('status')
+        if not 0 < limit <= current_app.config['USER_RESERVATIONS_MAX_PAGE_SIZE']:
+            return {'message': 'The limit has to be between 1 and {}.'.format(
+                current_app.config['USER_RESERVATIONS_MAX_PAGE_SIZE'])}, 400
+        if status is not None and status not in STATUSES:
+            return {'message': 'The status has to be one of {}.'.format(', '.join(STATUSES))}, 400
+        if not UserModel.find_by_id(user_id):
+            return {"message": USER_NOT_FOUND}, 404
+        after = None
+        if 'after' in request.args:
+            after = ReservationModel.find_by_id(request.args['after']) or ReservationArchiveModel.find_by_id(
+                request.args['after'])
+            if not after or after.user_id != user_id:
+                return {'message': 'That reservation was not found on the system.'}, 400
+        # The archived reservations are merged in, fetching one more reservation tells if there is a next page
+        reservations = sorted(
+            ReservationModel.find_page_by_user(user_id, after, limit + 1, status)
+            + ReservationArchiveModel.find_page_by_user(user_id, after, limit + 1, status),
+            key=lambda reservation: (reservation.expire_at, reservation.id), reverse=True
+        )[:limit + 1]
+        next_cursor = reservations[limit - 1].id if len(reservations) > limit else None
+        return {"reservations": dump_reservations(reservations[:limit]), "next": next_cursor}, 200
+
+
 class UserLogin(Resource):
     @classmethod
     def post(cls):
@@ -74,23 +113,34 @@ class UserLogin(Resource):
 
         user = UserModel.find_by_username(user_data.username)
 
-        if user and check_encrypted_password(user_data.password, user.password):
-            # token is valid for one week, generally it is minutes, but since this is not a production app, one week is
-            # good enough
-            access_token = create_access_token(identity=user.id, fresh=True, expires_delta=timedelta(days=7))
-            refresh_token = create_refresh_token(user.id, expires_delta=False)
-            return {"access_token": access_token, "refresh_token": refresh_token}, 200
-
-        return {"message": INVALID_CREDENTIALS}, 401
+        if not user:
+            return {"message": INVALID_CREDENTIALS}, 401
+        try:
+            valid, new_hash = password_hasher.verify_and_update(user_data.password, user.password)
+        except HashingBusy:
+            return {"message": SERVER_BUSY}, 503, {"Retry-After": "1"}
+        if not valid:
+            return {"message": INVALID_CREDENTIALS}, 401
+
+        # the configured rounds changed since the password was hashed
+        if new_hash:
+            user.password = new_hash
+            user.save_to_db()
+        # token is valid for one week, generally it is minutes, but since this is not a production app, one week is
+        # good enough
+        access_token = create_access_token(identity=user.id, fresh=True, expires_delta=timedelta(days=7))
+        refresh_token = create_refresh_token(user.id, expires_delta=False)
+        return {"access_token": access_token, "refresh_token": refresh_token}, 200
 
 
 class UserLogout(Resource):
     @classmethod
     @jwt_required
     def post(cls):
-        jti = get_raw_jwt()["jti"]
+        raw_jwt = get_raw_jwt()
         user_id = get_jwt_identity()
-        BLACKLIST.add(jti)
+        # revoked until the token expires
+        BLACKLIST.add(raw_jwt["jti"], raw_jwt.get("exp"))
         user = UserModel.find_by_id(user_id)
         return {"message": USER_LOGGED_OUT.format(user.username)}, 200
 
@@ -0,0 +1,12 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+
+# Periodic background work (e.g. the expiry sweeper), the jobs themselves are registered by the app
+scheduler = BackgroundScheduler({
+    'apscheduler.executors.default': {
+        'class': 'apscheduler.executors.pool:ThreadPoolExecutor',
+        'max_workers': '4'
+    },
+    'apscheduler.job_defaults.coalesce': 'true',
+    'apscheduler.job_defaults.max_instances': '1',
+    'apscheduler.timezone': 'Europe/London',
+})
@@ -7,7 +7,7 @@ from schemas.ticket import TicketSchema
 class EventSchema(ma.ModelSchema):
     class Meta:
         model = EventModel
-        exclude = ("reservations",)
+        exclude = ("reservations", "counters",)
     tickets = ma.Nested(TicketSchema, many=True)
     reservations = ma.Nested(ReservationSchema, many=True)
 
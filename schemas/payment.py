@@ -0,0 +1,8 @@
+from ma import ma
+from models.payment import PaymentModel
+
+
+class PaymentSchema(ma.ModelSchema):
+    class Meta:
+        model = PaymentModel
+        exclude = ("token", "idempotency_key",)
@@ -6,4 +6,8 @@ from models.reservation import ReservationModel
 class ReservationSchema(ma.ModelSchema):
     class Meta:
         model = ReservationModel
-        exclude = ("expire_at",)
+        exclude = ("created_at", "expire_at", "paid_at", "released", "version",)
+    # Dumped straight from the columns, so showing a reservation never loads the related rows
+    event = ma.Integer(attribute="event_id", dump_only=True)
+    user = ma.Integer(attribute="user_id", dump_only=True)
+    remaining_time = ma.String(dump_only=True)
@@ -3,7 +3,10 @@ from models.ticket import TicketModel
 
 
 class TicketSchema(ma.ModelSchema):
+    # shards included
+    number_available = ma.Integer(attribute="available", dump_only=True)
+
     class Meta:
         model = TicketModel
-        exclude = ("id", "event",)
+        exclude = ("id", "event", "version", "shard_count", "shards",)
 
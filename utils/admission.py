@@ -0,0 +1,112 @@
+"""
+Admission control for the reservations of hot events.
+
+Every (event, ticket type) pool has its own queue: a reservation request gets the next queue position and waits its
+turn, only ADMISSION_MAX_ACTIVE requests of a pool reach the database at a time. Past ADMISSION_MAX_QUEUE waiting
+requests, or after waiting ADMISSION_WAIT_TIMEOUT seconds, AdmissionBusy is raised so the request can be rejected
+with its position. Once a pool is found sold out it is answered from memory for ADMISSION_SOLD_OUT_TTL seconds (or
+until the expiry sweeper of this process releases tickets), so the database load follows the tickets left rather
+than the demand. The queues are kept per process, every uWSGI worker admits its own share.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class AdmissionBusy(Exception):
+    def __init__(self, position: int):
+        super().__init__("Too many reservations in progress for these tickets, please try again.")
+        self.position = position
+
+
+class _Pool:
+    def __init__(self):
+        self.next_position = 0
+        self.active = 0
+        self.waiting = deque()
+
+
+class AdmissionGate:
+    def __init__(self):
+        self.enabled = True
+        self.max_active = 8
+        self.max_queue = 200
+        self.timeout = 5
+        self.sold_out_ttl = 5
+        self._condition = threading.Condition()
+        self._pools = {}
+        self._sold_out = {}
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get("ADMISSION_ENABLED", True)
+        self.max_active = app.config.get("ADMISSION_MAX_ACTIVE", 8)
+        self.max_queue = app.config.get("ADMISSION_MAX_QUEUE", 200)
+        self.timeout = app.config.get("ADMISSION_WAIT_TIMEOUT", 5)
+        self.sold_out_ttl = app.config.get("ADMISSION_SOLD_OUT_TTL", 5)
+
+    def is_sold_out(self, event_id, ticket_type: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._condition:
+            until = self._sold_out.get((event_id, ticket_type))
+            if until is None:
+                return False
+            if until <= time.monotonic():
+                del self._sold_out[(event_id, ticket_type)]
+                return False
+            return True
+
+    def mark_sold_out(self, event_id, ticket_type: str) -> None:
+        if self.enabled:
+            with self._condition:
+                self._sold_out[(event_id, ticket_type)] = time.monotonic() + self.sold_out_ttl
+
+    # Tickets were given back (e.g. expired reservations), every pool has to be checked again
+    def reopen(self) -> None:
+        with self._condition:
+            self._sold_out.clear()
+
+    # Waits for a turn of the pool, the block runs with one of its ADMISSION_MAX_ACTIVE slots. Yields the queue position
+    @contextmanager
+    def admit(self, event_id, ticket_type: str):
+        if not self.enabled:
+            yield 0
+            return
+        key = (event_id, ticket_type)
+        with self._condition:
+            pool = self._pools.setdefault(key, _Pool())
+            position = pool.next_position
+            pool.next_position += 1
+            if len(pool.waiting) >= self.max_queue:
+                self._discard(key, pool)
+                raise AdmissionBusy(len(pool.waiting) + 1)
+            pool.waiting.append(position)
+            deadline = time.monotonic() + self.timeout
+            while pool.waiting[0] != position or pool.active >= self.max_active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    ahead = pool.waiting.index(position) + 1
+                    pool.waiting.remove(position)
+                    self._condition.notify_all()
+                    self._discard(key, pool)
+                    raise AdmissionBusy(ahead)
+                self._condition.wait(remaining)
+            pool.waiting.popleft()
+            pool.active += 1
+            self._condition.notify_all()
+        try:
+            yield position
+        finally:
+            with self._condition:
+                pool.active -= 1
+                self._condition.notify_all()
+                self._discard(key, pool)
+
+    # Idle pools are dropped, so only the events being sold are kept in memory
+    def _discard(self, key: tuple, pool: _Pool) -> None:
+        if not pool.active and not pool.waiting and self._pools.get(key) is pool:
+            del self._pools[key]
+
+
+admission_gate = AdmissionGate()
@@ -0,0 +1,35 @@
+import time
+from datetime import datetime, timedelta
+
+from models.reservation_archive import ReservationArchiveModel
+from utils.metrics import metrics
+
+
+class ReservationArchiver:
+    """Moves the reservations that can not change anymore to the archive, in batches that are each their own
+    transaction, so the reservations table only keeps what is still live. Keeps track of how much work each run did"""
+
+    def __init__(self):
+        self.stats = metrics.job_stats("reservation_archiver")
+
+    # Unpaid reservations released more than expired_after seconds ago first, then the reservations of the events that
+    # took place more than past_events_after seconds ago, at most max_batches batches of batch_size altogether
+    def archive(self, batch_size: int, max_batches: int, expired_after: float, past_events_after: float) -> int:
+        started = time.perf_counter()
+        now = datetime.now()
+        conditions = (ReservationArchiveModel.expired_before(now - timedelta(seconds=expired_after)),
+                      ReservationArchiveModel.past_events_before(now - timedelta(seconds=past_events_after)))
+        archived = 0
+        batches = 0
+        for condition in conditions:
+            while batches < max_batches:
+                moved = ReservationArchiveModel.archive_batch(condition, batch_size)
+                archived += moved
+                batches += 1
+                if moved < batch_size:
+                    break
+        self.stats.record(archived, time.perf_counter() - started)
+        return archived
+
+
+reservation_archiver = ReservationArchiver()
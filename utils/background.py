@@ -0,0 +1,112 @@
+"""
+Background work (expiry sweeps, payment dispatch, revoked token purges, reservation archival) for multi-process serving.
+
+Every process runs the scheduler, but only the leader runs the jobs: each process tries to take or renew the
+"background" lease every BACKGROUND_LEASE_RENEW seconds, and the lease expires BACKGROUND_LEASE_TTL seconds after
+its last renewal, so if the leader dies another process takes over. The scheduler is only started by start(), after
+uWSGI forked the workers (see wsgi.py), never at import time.
+"""
+import atexit
+import functools
+import os
+import socket
+import time
+from uuid import uuid4
+
+from blacklist import BLACKLIST
+from models.lease import LeaseModel
+from scheduler import scheduler
+from utils.archiver import reservation_archiver
+from utils.metrics import metrics
+from utils.payments import payment_processor
+from utils.sweeper import expiry_sweeper
+
+LEASE_NAME = "background"
+
+
+class BackgroundWorker:
+    def __init__(self):
+        self.app = None
+        self.identity = None
+        self.is_leader = False
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self._add_job(self.sweep_expired_reservations, "expiry_sweeper", app.config["EXPIRY_SWEEP_INTERVAL"])
+        self._add_job(payment_processor.dispatch, "payment_dispatcher", app.config["PAYMENT_POLL_INTERVAL"])
+        self._add_job(payment_processor.fail_stuck, "payment_reaper", app.config["PAYMENT_REAP_INTERVAL"])
+        self._add_job(self.purge_revoked_tokens, "revoked_token_purge", app.config["JWT_REVOCATION_PURGE_INTERVAL"])
+        self._add_job(self.archive_reservations, "reservation_archiver", app.config["ARCHIVE_INTERVAL"])
+
+    def _add_job(self, function, job_id: str, seconds: float) -> None:
+        scheduler.add_job(self._leader_only(function), 'interval', id=job_id, replace_existing=True, seconds=seconds)
+
+    def _leader_only(self, function):
+        @functools.wraps(function)
+        def wrapper():
+            if self.is_leader:
+                function()
+        return wrapper
+
+    # Called once per serving process (after the fork), starts the scheduler and the leader election
+    def start(self) -> None:
+        if scheduler.running:
+            return
+        self.identity = "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid4().hex[:8])
+        self.heartbeat()
+        scheduler.add_job(self.heartbeat, 'interval', id='background_lease', replace_existing=True,
+                          seconds=self.app.config["BACKGROUND_LEASE_RENEW"])
+        scheduler.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        if self.is_leader:
+            self.is_leader = False
+            with self.app.app_context():
+                LeaseModel.release(LEASE_NAME, self.identity)
+
+    def heartbeat(self) -> None:
+        with self.app.app_context():
+            try:
+                leader = LeaseModel.acquire(LEASE_NAME, self.identity, self.app.config["BACKGROUND_LEASE_TTL"])
+            except Exception:
+                # without the database the lease can not be renewed, so another process may take over
+                leader = False
+                self.app.logger.exception("Failed to renew the background lease")
+        if leader != self.is_leader:
+            self.app.logger.info("%s %s the background work", self.identity, "took over" if leader else "stopped")
+        self.is_leader = leader
+
+    # Single periodic job releasing the tickets of every expired reservation
+    def sweep_expired_reservations(self) -> None:
+        with self.app.app_context():
+            processed = expiry_sweeper.sweep(self.app.config["EXPIRY_SWEEP_BATCH_SIZE"])
+            metrics.observe_job("expiry_sweeper", expiry_sweeper.stats.last_duration, processed)
+            if processed:
+                self.app.logger.info("Expiry sweep released %s reservations in %.3fs",
+                                     processed, expiry_sweeper.stats.last_duration)
+
+    # Revoked tokens are only kept until they expire
+    def purge_revoked_tokens(self) -> None:
+        with self.app.app_context():
+            started = time.perf_counter()
+            purged = BLACKLIST.purge()
+            metrics.observe_job("revoked_token_purge", time.perf_counter() - started, purged)
+
+    # Reservations that can not change anymore are moved out of the reservations table, a few batches per run
+    def archive_reservations(self) -> None:
+        with self.app.app_context():
+            config = self.app.config
+            archived = reservation_archiver.archive(
+                config["ARCHIVE_BATCH_SIZE"], config["ARCHIVE_MAX_BATCHES"], config["ARCHIVE_EXPIRED_AFTER"],
+                config["ARCHIVE_PAST_EVENTS_AFTER"]
+            )
+            metrics.observe_job("reservation_archiver", reservation_archiver.stats.last_duration, archived)
+            if archived:
+                self.app.logger.info("Archived %s reservations in %.3fs", archived,
+                                     reservation_archiver.stats.last_duration)
+
+
+background = BackgroundWorker()
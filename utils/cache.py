@@ -0,0 +1,166 @@
+"""
+Read-through cache for the event snapshots and the ticket availability.
+
+Entries are kept in an in-process LRU (CACHE_MAX_ENTRIES) and, with CACHE_BACKEND = "redis", in a shared Redis
+(CACHE_REDIS_URL, needs the redis package) so the workers fill it for each other. Every entry expires at a fixed
+time, also when it is copied from Redis to the LRU: event snapshots after CACHE_EVENT_TTL seconds and the
+availability after CACHE_AVAILABILITY_TTL seconds, which bounds how stale it can be served. On top of that, the keys
+touched by a transaction (e.g. a ticket pool claimed or released) are dropped once it ends, see invalidate_on_commit.
+Hits and misses are counted per kind of entry in cache_requests_total on /metrics.
+"""
+import json
+import logging
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.lru import TTLCache
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+REDIS_PREFIX = "manage-events:"
+
+
+def event_key(event_id) -> str:
+    return "event:{}".format(event_id)
+
+
+def event_name_key(name: str) -> str:
+    return "event-name:{}".format(name)
+
+
+def availability_key(event_id) -> str:
+    return "availability:{}".format(event_id)
+
+
+def shards_key(event_id) -> str:
+    return "shards:{}".format(event_id)
+
+
+def timeseries_key(event_id, width: int, start: int) -> str:
+    return "timeseries:{}:{}:{}".format(event_id, width, start)
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND = 'redis' needs the redis package to be installed")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        raw = self.client.get(REDIS_PREFIX + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, entry: dict, ttl: float) -> None:
+        self.client.set(REDIS_PREFIX + key, json.dumps(entry), px=max(1, int(ttl * 1000)))
+
+    def delete(self, *keys) -> None:
+        self.client.delete(*(REDIS_PREFIX + key for key in keys))
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(REDIS_PREFIX + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache:
+    def __init__(self):
+        self.enabled = True
+        self.event_ttl = 300
+        self.availability_ttl = 1
+        self.local = TTLCache(10000)
+        self.shared = None
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get("CACHE_ENABLED", True)
+        self.event_ttl = app.config.get("CACHE_EVENT_TTL", 300)
+        self.availability_ttl = app.config.get("CACHE_AVAILABILITY_TTL", 1)
+        self.local = TTLCache(app.config.get("CACHE_MAX_ENTRIES", 10000))
+        if app.config.get("CACHE_BACKEND", "memory") == "redis":
+            self.shared = RedisBackend(app.config["CACHE_REDIS_URL"])
+        if not event.contains(Session, "after_commit", self._after_transaction):
+            event.listen(Session, "after_commit", self._after_transaction)
+            event.listen(Session, "after_rollback", self._after_transaction)
+
+    # Returns the cached value of key, or loads it and keeps it for ttl seconds. None is never cached
+    def get_or_set(self, key: str, loader, ttl: float):
+        if not self.enabled:
+            return loader()
+        kind = key.split(":", 1)[0]
+        value = self._get(key)
+        if value is not MISSING:
+            metrics.inc("cache_requests_total", {"cache": kind, "result": "hit"})
+            return value
+        metrics.inc("cache_requests_total", {"cache": kind, "result": "miss"})
+        value = loader()
+        if value is not None:
+            self._set(key, value, ttl)
+        return value
+
+    # Cached value of key or None, for the entries loaded in batches by the caller and stored with set
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        value = self._get(key)
+        metrics.inc("cache_requests_total", {"cache": key.split(":", 1)[0],
+                                             "result": "miss" if value is MISSING else "hit"})
+        return None if value is MISSING else value
+
+    def set(self, key: str, value, ttl: float) -> None:
+        if self.enabled and value is not None:
+            self._set(key, value, ttl)
+
+    def _get(self, key: str):
+        value = self.local.get(key, MISSING)
+        if value is MISSING and self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception:
+                logger.exception("Failed to read %s from the shared cache", key)
+                return MISSING
+            if entry is not None and entry["expires_at"] > time.time():
+                value = entry["value"]
+                self.local.set(key, value, entry["expires_at"])
+        return value
+
+    def _set(self, key: str, value, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        self.local.set(key, value, expires_at)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, {"value": value, "expires_at": expires_at}, ttl)
+            except Exception:
+                logger.exception("Failed to write %s to the shared cache", key)
+
+    def delete(self, *keys) -> None:
+        for key in keys:
+            self.local.delete(key)
+        if self.shared is not None and keys:
+            try:
+                self.shared.delete(*keys)
+            except Exception:
+                logger.exception("Failed to invalidate %s in the shared cache", ", ".join(keys))
+
+    def clear(self) -> None:
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    # The keys are dropped when the transaction of the session ends, after a rollback as well since the entries
+    # may have been loaded from its uncommitted changes
+    @staticmethod
+    def invalidate_on_commit(session, *keys) -> None:
+        session.info.setdefault("cache_invalidations", set()).update(keys)
+
+    def _after_transaction(self, session):
+        keys = session.info.pop("cache_invalidations", None)
+        if keys:
+            self.delete(*keys)
+
+
+cache = Cache()
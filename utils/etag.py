@@ -0,0 +1,48 @@
+"""
+Conditional GET with strong ETags.
+
+A resource declares what its representation depends on (e.g. a version column), cheap to read compared to loading and
+dumping it. The ETag is a hash of those parts, if the client already has it (If-None-Match) a 304 is returned without
+running the handler at all, otherwise the ETag is added to its 200 response. Handlers that need to load the resource
+anyway compute the parts from it instead (see conditional_response).
+"""
+import functools
+import hashlib
+
+from flask import current_app, request
+
+
+def make_etag(parts) -> str:
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:32]
+
+
+# A 304 if the client already has the representation with these ETag parts, otherwise the result of render() with
+# the ETag added when it is a 200
+def conditional_response(parts, render):
+    etag = make_etag(parts)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    result = render()
+    if not isinstance(result, tuple):
+        result = (result, 200)
+    if result[1] != 200:
+        return result
+    headers = dict(result[2]) if len(result) > 2 else {}
+    headers["ETag"] = '"{}"'.format(etag)
+    return result[0], result[1], headers
+
+
+# etag_parts is called with the arguments of the view and returns the parts of the ETag, or None to skip the check
+# (e.g. the resource does not exist and the handler answers the error)
+def conditional(etag_parts):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            parts = etag_parts(**kwargs)
+            if parts is None:
+                return function(*args, **kwargs)
+            return conditional_response(parts, lambda: function(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,124 @@
+"""
+Bulk event import from JSONL (one event per line) or CSV (name,date,time header) files.
+
+The file is streamed and imported in chunks, every row is validated with EventSchema and the events of a chunk, their
+tickets (split across INVENTORY_SHARDS shards, like the events created one by one) and their reservation counters go
+in with bulk inserts and a single commit, so memory stays constant whatever the file size. Invalid rows are reported
+(up to max_errors of them) without aborting the import.
+"""
+import codecs
+import csv
+import json
+from itertools import islice
+
+from marshmallow import ValidationError
+
+from db import db
+from models.counter import CounterModel
+from models.event import EventModel
+from models.ticket import TicketModel
+from models.ticket_shard import TicketShardModel
+from schemas.event import EventSchema
+from utils.conts import ticket_numbers, ticket_types
+
+IMPORT_FIELDS = {"name", "date", "time"}
+FORMATS = ("jsonl", "csv")
+
+event_schema = EventSchema()
+
+
+# Yields (line number, row) for every non empty line, row is None when the line could not be parsed
+def read_rows(stream, file_format: str):
+    lines = codecs.getreader("utf-8")(stream)
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row
+
+
+def validate_row(row) -> tuple:
+    if row is None:
+        return None, {"_schema": ["Invalid JSON."]}
+    if not isinstance(row, dict) or not set(row.keys()).issubset(IMPORT_FIELDS):
+        return None, {"_schema": ["Each row needs a name, a date and a time, and nothing else."]}
+    try:
+        event = event_schema.load(row)
+    except ValidationError as err:
+        return None, err.messages
+    return {"name": event.name, "date": event.date, "time": event.time}, None
+
+
+# Inserts the events of a chunk and returns their ids in the same order. Postgres does it in one statement, other
+# databases need one insert per event to get the ids back
+def insert_events(events: list) -> list:
+    if db.engine.dialect.name == "postgresql":
+        result = db.session.execute(EventModel.__table__.insert().values(events).returning(EventModel.__table__.c.id))
+        return [row[0] for row in result]
+    db.session.bulk_insert_mappings(EventModel, events, return_defaults=True)
+    return [event["id"] for event in events]
+
+
+# The pools of the new events are sharded right away when shard_count is above 1, the same rows TicketModel.shard
+# leaves behind, without locking anything
+def import_chunk(events: list, shard_count: int = 1) -> None:
+    shard_count = shard_count if shard_count > 1 else 0
+    ids = insert_events(events)
+    db.session.bulk_insert_mappings(TicketModel, [
+        {"event_id": event_id, "ticket_type": ticket_type, "shard_count": shard_count,
+         "number_available": 0 if shard_count else ticket_numbers[ticket_type]}
+        for event_id in ids for ticket_type in ticket_types
+    ])
+    if shard_count:
+        tickets = db.session.query(TicketModel.id, TicketModel.ticket_type).filter(TicketModel.event_id.in_(ids))
+        db.session.bulk_insert_mappings(TicketShardModel, [
+            {"ticket_id": ticket_id, "shard": shard, "number_available": number_available, "version": 0}
+            for ticket_id, ticket_type in tickets
+            for shard, number_available in enumerate(TicketModel.split(ticket_numbers[ticket_type], shard_count))
+        ])
+    db.session.bulk_insert_mappings(CounterModel, [
+        {"event_id": event_id, "ticket_type": ticket_type, "shard": shard, "total": 0, "paid": 0, "expired": 0}
+        for event_id in ids for ticket_type in ticket_types for shard in range(max(shard_count, 1))
+    ])
+    db.session.commit()
+
+
+def import_events(stream, file_format: str, chunk_size: int, max_errors: int, shard_count: int = 1) -> dict:
+    report = {"imported": 0, "failed": 0, "errors": []}
+
+    def add_error(line, errors):
+        report["failed"] += 1
+        if len(report["errors"]) < max_errors:
+            report["errors"].append({"line": line, "errors": errors})
+
+    rows = read_rows(stream, file_format)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        events, lines = [], []
+        for line_number, row in chunk:
+            event, errors = validate_row(row)
+            if errors:
+                add_error(line_number, errors)
+            else:
+                events.append(event)
+                lines.append(line_number)
+        if not events:
+            continue
+        try:
+            import_chunk(events, shard_count)
+            report["imported"] += len(events)
+        except Exception as err:
+            db.session.rollback()
+            for line_number in lines:
+                add_error(line_number, {"_schema": ["Failed to store the event: {}".format(err.__class__.__name__)]})
+    return report
@@ -0,0 +1,263 @@
+"""
+Live availability and reservation updates, streamed as Server-Sent Events (GET /event/id/<id>/stream).
+
+Every process has one hub. While there are subscribers its poller thread runs every LIVE_POLL_INTERVAL seconds: one
+query reads the versions of the ticket pools of every watched event and another the state of every reservation being
+followed, whatever the number of subscribers. What changed is encoded once and handed to every subscriber of the
+event. Each subscriber has its own bounded queue: the availability is a state, so an update still pending when a newer
+one comes is replaced, while reservation transitions (paid, expired) are queued and a subscriber that lets
+LIVE_MAX_QUEUE of them pile up is disconnected (the browser reconnects and starts again from a snapshot). At most
+LIVE_MAX_SUBSCRIBERS streams are open per process, each one is closed after LIVE_STREAM_TIMEOUT seconds and the browser
+reconnects LIVE_RETRY seconds later.
+"""
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from db import db
+from models.reservation import ReservationModel, remaining_time
+from models.ticket import TicketModel
+from utils.cache import availability_key, cache
+from utils.metrics import metrics
+
+# Reservations read per query by the poller, below the bound parameters limit of SQLite
+STATES_CHUNK_SIZE = 500
+
+
+class LiveBusy(Exception):
+    def __init__(self):
+        super().__init__("Too many live updates streams open, please try again later.")
+
+
+def encode(kind: str, data: dict) -> str:
+    return "event: {}\ndata: {}\n\n".format(kind, json.dumps(data, separators=(",", ":")))
+
+
+def availability_message(event_id: int, available: dict) -> str:
+    return encode("availability", {"event_id": event_id, "tickets": [
+        {"ticket_type": ticket_type, "number_available": number_available}
+        for ticket_type, number_available in available.items()
+    ]})
+
+
+# The countdown runs in the browser from expires_in, the stream only tells when the reservation is paid or expired
+def reservation_message(state: dict) -> str:
+    expires_in = 0
+    if not state["paid"] and not state["expired"]:
+        expires_in = max(0, int((state["expire_at"] - datetime.now()).total_seconds()))
+    return encode("reservation", {
+        "id": state["id"],
+        "paid": state["paid"],
+        "expired": state["expired"],
+        "remaining_time": "Expired" if state["expired"] else remaining_time(state["paid"], state["expire_at"]),
+        "expires_in": expires_in,
+    })
+
+
+def transition(state: dict) -> tuple:
+    return state["paid"], state["expired"], state["expire_at"]
+
+
+class Subscriber:
+    def __init__(self, event_id: int, reservation_ids, max_queue: int):
+        self.event_id = event_id
+        self.reservation_ids = frozenset(reservation_ids)
+        self.max_queue = max_queue
+        self.availability = None
+        self.messages = deque()
+        self.closed = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    # Replaces the availability not sent yet, if any
+    def set_availability(self, message: str) -> None:
+        with self._lock:
+            self.availability = message
+            self._wake.set()
+
+    # Queues a message, a subscriber too slow to keep up is closed instead. Returns False once it is closed
+    def push(self, message: str) -> bool:
+        with self._lock:
+            if len(self.messages) >= self.max_queue:
+                self.closed = True
+            else:
+                self.messages.append(message)
+            self._wake.set()
+        return not self.closed
+
+    # Messages to send, in order, waiting up to timeout seconds for one (an empty list if none came)
+    def wait(self, timeout: float) -> list:
+        self._wake.wait(timeout)
+        with self._lock:
+            self._wake.clear()
+            messages = list(self.messages)
+            self.messages.clear()
+            if self.availability is not None:
+                messages.append(self.availability)
+                self.availability = None
+        return messages
+
+
+class Stream:
+    """Body of a streaming response, the subscription is closed with it (also when it was never iterated)"""
+
+    def __init__(self, hub: "LiveHub", subscriber: Subscriber):
+        self.hub = hub
+        self.subscriber = subscriber
+
+    def __iter__(self):
+        return self.hub.messages(self.subscriber)
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self.subscriber)
+
+
+class LiveHub:
+    def __init__(self):
+        self.enabled = True
+        self.poll_interval = 1
+        self.max_queue = 100
+        self.max_subscribers = 100
+        self.heartbeat = 15
+        self.stream_timeout = 300
+        self.retry = 3
+        self.app = None
+        self._lock = threading.Lock()
+        self._poller = None
+        # event id -> subscribers, and the version and message of its availability last sent
+        self._subscribers = {}
+        self._pools = {}
+        # reservation id -> subscribers following it, and its transition and message last sent
+        self._followers = {}
+        self._reservations = {}
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.enabled = app.config.get("LIVE_ENABLED", True)
+        self.poll_interval = app.config.get("LIVE_POLL_INTERVAL", 1)
+        self.max_queue = app.config.get("LIVE_MAX_QUEUE", 100)
+        self.max_subscribers = app.config.get("LIVE_MAX_SUBSCRIBERS", 100)
+        self.heartbeat = app.config.get("LIVE_HEARTBEAT", 15)
+        self.stream_timeout = app.config.get("LIVE_STREAM_TIMEOUT", 300)
+        self.retry = app.config.get("LIVE_RETRY", 3)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    # Subscribes to the event and to the given reservations of it (the others are ignored), the current availability
+    # and reservation states are queued first. Called while handling the request, the database is only read for what
+    # the hub does not follow yet. Raises LiveBusy past LIVE_MAX_SUBSCRIBERS
+    def subscribe(self, event_id: int, reservation_ids) -> Stream:
+        if self.subscriber_count() >= self.max_subscribers:
+            raise LiveBusy()
+        subscriber = Subscriber(event_id, reservation_ids, self.max_queue)
+        pool = self._pools.get(event_id)
+        if pool is None:
+            loaded = TicketModel.find_pool(event_id) or {"version": None, "available": {}}
+            pool = loaded["version"], availability_message(event_id, loaded["available"])
+        missing = [_id for _id in subscriber.reservation_ids if _id not in self._reservations]
+        states = ReservationModel.find_states(missing, event_id) if missing else {}
+
+        with self._lock:
+            subscriber.set_availability(self._pools.setdefault(event_id, pool)[1])
+            for _id in subscriber.reservation_ids:
+                if _id in states and _id not in self._reservations:
+                    self._reservations[_id] = transition(states[_id]), reservation_message(states[_id])
+                if _id in self._reservations:
+                    subscriber.push(self._reservations[_id][1])
+                    self._followers.setdefault(_id, set()).add(subscriber)
+            self._subscribers.setdefault(event_id, set()).add(subscriber)
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._run, name="live-poller", daemon=True)
+                self._poller.start()
+        metrics.inc("live_subscribers", {})
+        return Stream(self, subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.event_id)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.event_id]
+                del self._pools[subscriber.event_id]
+            for _id in subscriber.reservation_ids:
+                followers = self._followers.get(_id)
+                if followers is not None:
+                    followers.discard(subscriber)
+                    if not followers:
+                        del self._followers[_id]
+                        del self._reservations[_id]
+        metrics.inc("live_subscribers", {}, -1)
+
+    # Server-Sent Events of a subscriber until the stream times out, the subscriber falls behind or the client is gone
+    # (found out when the heartbeat can not be written)
+    def messages(self, subscriber: Subscriber):
+        yield "retry: {}\n\n".format(int(self.retry * 1000))
+        deadline = time.monotonic() + self.stream_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.inc("live_disconnects_total", {"reason": "timeout"})
+                return
+            messages = subscriber.wait(min(self.heartbeat, remaining))
+            if subscriber.closed:
+                metrics.inc("live_disconnects_total", {"reason": "slow"})
+                return
+            yield "".join(messages) if messages else ": keep-alive\n\n"
+
+    # The poller stops once nobody is subscribed, the next subscriber starts it again
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._subscribers:
+                    self._poller = None
+                    return
+                event_ids = list(self._subscribers)
+                reservation_ids = list(self._followers)
+            with self.app.app_context():
+                try:
+                    self.poll(event_ids, reservation_ids)
+                except Exception:
+                    self.app.logger.exception("Failed to poll the live updates")
+                finally:
+                    db.session.remove()
+
+    # One query for the versions of the pools and one per STATES_CHUNK_SIZE reservations, the availability of the pools
+    # that changed is loaded fresh. Every change is broadcast to the subscribers of the event
+    def poll(self, event_ids: list, reservation_ids: list) -> None:
+        versions = TicketModel.find_versions(event_ids)
+        pools = {}
+        for event_id in event_ids:
+            known = self._pools.get(event_id)
+            if known is not None and versions.get(event_id) != known[0]:
+                # the cached availability may be older than the version just read
+                cache.delete(availability_key(event_id))
+                pool = TicketModel.find_pool(event_id) or {"version": None, "available": {}}
+                pools[event_id] = pool["version"], availability_message(event_id, pool["available"])
+        states = {}
+        for start in range(0, len(reservation_ids), STATES_CHUNK_SIZE):
+            states.update(ReservationModel.find_states(reservation_ids[start:start + STATES_CHUNK_SIZE]))
+
+        with self._lock:
+            for event_id, pool in pools.items():
+                if event_id in self._subscribers:
+                    self._pools[event_id] = pool
+                    for subscriber in self._subscribers[event_id]:
+                        subscriber.set_availability(pool[1])
+            for _id, state in states.items():
+                known = self._reservations.get(_id)
+                if known is None or known[0] == transition(state):
+                    continue
+                message = reservation_message(state)
+                self._reservations[_id] = transition(state), message
+                for subscriber in self._followers[_id]:
+                    subscriber.push(message)
+
+
+live_hub = LiveHub()
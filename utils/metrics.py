@@ -0,0 +1,203 @@
+"""
+Request, database and background job instrumentation, exposed in the Prometheus text format on /metrics.
+
+SQLAlchemy engine events count the queries and the time spent in the database while a request is handled, the
+per-request figures can also be returned in the X-DB-Queries, X-DB-Time and X-DB-Commits response headers
+(METRICS_HEADERS).
+"""
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: dict) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(_sample(name + "_bucket", {**labels, "le": repr(bound)}, cumulative))
+        lines.append(_sample(name + "_bucket", {**labels, "le": "+Inf"}, self.count))
+        lines.append(_sample(name + "_sum", labels, self.sum))
+        lines.append(_sample(name + "_count", labels, self.count))
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: dict, value) -> str:
+    if labels:
+        name += "{" + ",".join('{}="{}"'.format(key, _escape(val)) for key, val in labels.items()) + "}"
+    return "{} {}".format(name, value)
+
+
+class JobStats:
+    """How much work the runs of a background job did in this process, kept by the job itself and read when the
+    metrics are rendered (see Metrics.job_stats)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.processed_total = 0
+        self.last_processed = 0
+        self.last_duration = 0.0
+
+    def record(self, processed: int, duration: float) -> None:
+        with self._lock:
+            self.runs += 1
+            self.processed_total += processed
+            self.last_processed = processed
+            self.last_duration = duration
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "processed_total": self.processed_total,
+                "last_processed": self.last_processed,
+                "last_duration": self.last_duration,
+            }
+
+
+class Metrics:
+    # name -> (type, help), in the order they are rendered
+    families = {
+        "http_requests_total": ("counter", "Requests handled, by route, method and status."),
+        "http_request_duration_seconds": ("histogram", "Request latency, by route and method."),
+        "db_queries_total": ("counter", "Queries executed while handling requests, by route."),
+        "db_time_seconds": ("histogram", "Time spent in the database per request, by route."),
+        "db_commits_total": ("counter", "Committed transactions, including the background jobs."),
+        "background_job_duration_seconds": ("histogram", "Duration of the background jobs, by job."),
+        "background_job_rows_total": ("counter", "Rows processed by the background jobs, by job."),
+        "background_job_runs_total": ("counter", "Runs of the background jobs in this process, by job."),
+        "background_job_last_rows": ("gauge", "Rows processed by the last run of a background job, by job."),
+        "background_job_last_duration_seconds": ("gauge", "Duration of the last run of a background job, by job."),
+        "cache_requests_total": ("counter", "Cache lookups, by kind of entry and result (hit or miss)."),
+        "live_subscribers": ("gauge", "Live updates streams open."),
+        "live_disconnects_total": ("counter", "Live updates streams closed by the server, by reason."),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._samples = {name: {} for name in self.families}
+        self._jobs = {}
+        self.headers = False
+
+    def init_app(self, app) -> None:
+        self.headers = app.config.get("METRICS_HEADERS", False)
+        if not event.contains(Engine, "before_cursor_execute", self._before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            event.listen(Session, "after_commit", self._after_commit)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    # Per-request figures live in a thread local, so queries run by background threads are not mixed in
+    def _current(self):
+        return getattr(self._local, "request", None)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        current = self._current()
+        if current is not None:
+            current["queries"] += 1
+            current["db_time"] += elapsed
+
+    def _after_commit(self, session):
+        current = self._current()
+        if current is not None:
+            current["commits"] += 1
+        self.inc("db_commits_total", {})
+
+    def _before_request(self):
+        self._local.request = {"started": time.perf_counter(), "queries": 0, "db_time": 0.0, "commits": 0}
+
+    def _after_request(self, response):
+        current = self._current()
+        if current is None:
+            return response
+        self._local.request = None
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        labels = {"route": route, "method": request.method}
+        self.inc("http_requests_total", {**labels, "status": response.status_code})
+        self.observe("http_request_duration_seconds", labels, time.perf_counter() - current["started"])
+        self.inc("db_queries_total", {"route": route}, current["queries"])
+        self.observe("db_time_seconds", {"route": route}, current["db_time"])
+        if self.headers:
+            response.headers["X-DB-Queries"] = str(current["queries"])
+            response.headers["X-DB-Time"] = "{:.6f}".format(current["db_time"])
+            response.headers["X-DB-Commits"] = str(current["commits"])
+        return response
+
+    def inc(self, name: str, labels: dict, amount=1) -> None:
+        key = tuple(labels.items())
+        with self._lock:
+            self._samples[name][key] = self._samples[name].get(key, 0) + amount
+
+    def set(self, name: str, labels: dict, value) -> None:
+        with self._lock:
+            self._samples[name][tuple(labels.items())] = value
+
+    # The run stats of a background job, one per job name, rendered with the other metrics
+    def job_stats(self, job: str) -> JobStats:
+        with self._lock:
+            return self._jobs.setdefault(job, JobStats())
+
+    def observe(self, name: str, labels: dict, value: float) -> None:
+        key = tuple(labels.items())
+        with self._lock:
+            histogram = self._samples[name].get(key)
+            if histogram is None:
+                histogram = self._samples[name][key] = Histogram()
+            histogram.observe(value)
+
+    def observe_job(self, job: str, seconds: float, rows: int = 0) -> None:
+        self.observe("background_job_duration_seconds", {"job": job}, seconds)
+        self.inc("background_job_rows_total", {"job": job}, rows)
+
+    def render(self) -> str:
+        for job, stats in list(self._jobs.items()):
+            stats = stats.snapshot()
+            self.set("background_job_runs_total", {"job": job}, stats["runs"])
+            self.set("background_job_last_rows", {"job": job}, stats["last_processed"])
+            self.set("background_job_last_duration_seconds", {"job": job}, stats["last_duration"])
+        lines = []
+        with self._lock:
+            for name, (kind, description) in self.families.items():
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for key, value in sorted(self._samples[name].items(), key=lambda item: str(item[0])):
+                    if kind == "histogram":
+                        lines.extend(value.render(name, dict(key)))
+                    else:
+                        lines.append(_sample(name, dict(key), value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
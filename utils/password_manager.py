@@ -1,15 +1,120 @@
+"""
+Password hashing with pbkdf2_sha256.
+
+Hashing is CPU bound, so it runs in a small process pool (PASSWORD_HASH_WORKERS, 0 hashes in the calling thread)
+instead of the request workers. At most PASSWORD_HASH_MAX_PENDING hashes can be queued, past that HashingBusy is
+raised straight away so the request can be rejected, as it is when a hash takes longer than PASSWORD_HASH_TIMEOUT or
+the pool broke (it is created again for the next one). A queued hash holds its slot until it is done, even if the
+request stopped waiting for it. Hashes made with other rounds than PASSWORD_HASH_ROUNDS are flagged on verification
+so they can be updated on login.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(
-    schemes=["pbkdf2_sha256"],
-    default="pbkdf2_sha256",
-    pbkdf2_sha256__default_rounds=30000
-)
+DEFAULT_ROUNDS = 30000
+
+_contexts = {}
+
+
+class HashingBusy(Exception):
+    pass
+
+
+# One context per number of rounds, hashes with other rounds need an update
+def _context(rounds: int) -> CryptContext:
+    if rounds not in _contexts:
+        _contexts[rounds] = CryptContext(
+            schemes=["pbkdf2_sha256"],
+            default="pbkdf2_sha256",
+            pbkdf2_sha256__default_rounds=rounds,
+            pbkdf2_sha256__min_rounds=rounds,
+            pbkdf2_sha256__max_rounds=rounds,
+        )
+    return _contexts[rounds]
+
+
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int) -> tuple:
+    return _context(rounds).verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.rounds = DEFAULT_ROUNDS
+        self.workers = 0
+        self.timeout = None
+        self._slots = threading.BoundedSemaphore(16)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.rounds = app.config.get("PASSWORD_HASH_ROUNDS", DEFAULT_ROUNDS)
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", 0)
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT")
+        self._slots = threading.BoundedSemaphore(app.config.get("PASSWORD_HASH_MAX_PENDING", 16))
+
+    # The pool is created on first use, so every (pre)forked worker gets its own
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    # A pool that lost a process can not be used anymore, the next hash creates a new one
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy("Too many password checks in progress, please try again.")
+        if not self.workers:
+            try:
+                return function(*args)
+            finally:
+                self._slots.release()
+        executor = self._pool()
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise HashingBusy("The password check failed, please try again.")
+        except Exception:
+            self._slots.release()
+            raise
+        # the slot is only given back once the hash is done, also when the wait below times out
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashingBusy("The password check took too long, please try again.")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise HashingBusy("The password check failed, please try again.")
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password, self.rounds)
+
+    # Returns (valid, new_hash), new_hash is only set when the stored hash has to be replaced
+    def verify_and_update(self, password: str, hashed: str) -> tuple:
+        return self._run(_verify_and_update, password, hashed, self.rounds)
+
+
+password_hasher = PasswordHasher()
 
 
 def encrypt_password(password):
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
 
 
 def check_encrypted_password(password, hashed):
-    return pwd_context.verify(password, hashed)
+    return password_hasher.verify_and_update(password, hashed)[0]
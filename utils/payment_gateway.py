@@ -0,0 +1,34 @@
+from collections import namedtuple
+
+
+class CardError(Exception):
+    pass
+
+
+class PaymentError(Exception):
+    pass
+
+
+class CurrencyError(Exception):
+    pass
+
+
+PaymentResult = namedtuple('PaymentResult', ('amount', 'currency'))
+
+
+class PaymentGateway:
+    supported_currencies = ('EUR', 'PLN',)
+
+    def charge(self, amount: int, token: str, currency: str = 'EUR'):
+        if token == 'card_error':
+            raise CardError("Your card has been declined")
+        elif token == 'payment_error':
+            raise PaymentError("Something went wrong with your transaction")
+        elif currency not in self.supported_currencies:
+            raise CurrencyError(f"Currency {currency} not supported")
+        else:
+            return {'PaymentResult': PaymentResult(amount, currency)._asdict()}, 200
+
+    # Gives back a charge that went through, e.g. when the reservation expired while it was being charged
+    def refund(self, amount: int, token: str, currency: str = 'EUR'):
+        return {'PaymentResult': PaymentResult(-amount, currency)._asdict()}, 200
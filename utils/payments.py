@@ -0,0 +1,117 @@
+"""
+Payment workers.
+
+Payments are queued in the payments table when they are submitted. A periodic dispatch claims the pending ones and
+hands them to a local pool of PAYMENT_WORKERS threads, which charge them through the PaymentGateway and mark the
+reservation as paid in the same transaction as the payment result. The expiry sweeper may release the reservation
+while it is being charged, the reservation is then left as it is and the charge refunded. Payments still processing
+PAYMENT_PROCESSING_TIMEOUT seconds after they were claimed (the worker died) are failed by a periodic check.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from db import db
+from models.payment import PaymentModel, FAILED, SUCCEEDED
+from models.reservation import ReservationModel
+from utils.metrics import metrics
+from utils.payment_gateway import CardError, CurrencyError, PaymentError, PaymentGateway
+
+INTERNAL_ERROR = "Internal server error. Failed to process payment."
+
+
+class PaymentProcessor:
+    def __init__(self):
+        self.app = None
+        self.batch_size = 50
+        self.processing_timeout = 300
+        self.gateway = PaymentGateway()
+        self._executor = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.batch_size = app.config["PAYMENT_BATCH_SIZE"]
+        self.processing_timeout = app.config["PAYMENT_PROCESSING_TIMEOUT"]
+        self._executor = ThreadPoolExecutor(max_workers=app.config["PAYMENT_WORKERS"])
+
+    def dispatch(self) -> int:
+        with self.app.app_context():
+            payment_ids = PaymentModel.claim_pending(self.batch_size)
+        for payment_id in payment_ids:
+            self._executor.submit(self.process, payment_id)
+        return len(payment_ids)
+
+    # A payment that can not be processed is failed instead of being left in processing, where it would cover its
+    # reservation forever
+    def process(self, payment_id: str) -> None:
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                self.charge(payment_id)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception("Failed to process payment %s", payment_id)
+                PaymentModel.fail(payment_id, INTERNAL_ERROR)
+                db.session.commit()
+        metrics.observe_job("payment", time.perf_counter() - started, 1)
+
+    # Charges the payment and records the result with the reservation, committed. A charge that did not pay the
+    # reservation is refunded, also when the result could not be recorded
+    def charge(self, payment_id: str) -> None:
+        payment = PaymentModel.find_by_id(payment_id)
+        reservation = ReservationModel.find_by_id(payment.reservation_id)
+        if not reservation or reservation.expired or reservation.released:
+            payment.finish(FAILED, "Sorry, that reservation is already expired. Please make a new reservation "
+                                   "and pay after.")
+        elif reservation.paid:
+            payment.finish(FAILED, "That reservation is already paid.")
+        else:
+            charge = {"amount": payment.amount, "token": payment.token, "currency": payment.currency}
+            try:
+                self.gateway.charge(**charge)
+            except (CardError, PaymentError, CurrencyError) as e:
+                payment.finish(FAILED, str(e))
+            except Exception:
+                payment.finish(FAILED, INTERNAL_ERROR)
+            else:
+                paid = False
+                try:
+                    if reservation.mark_paid():
+                        payment.finish(SUCCEEDED)
+                    else:
+                        payment.finish(FAILED, "Sorry, that reservation expired while it was being paid, the charge "
+                                               "was refunded. Please make a new reservation and pay after.")
+                    db.session.commit()
+                    paid = payment.status == SUCCEEDED
+                finally:
+                    if not paid:
+                        self.gateway.refund(**charge)
+                return
+        db.session.commit()
+
+    # Payments left in processing for longer than PAYMENT_PROCESSING_TIMEOUT seconds, by a worker that died while
+    # charging them, are failed so their reservation can be paid again. The worker may have charged the card before it
+    # died, so the charge of every payment failed here is refunded, as when a charge does not pay the reservation
+    def fail_stuck(self) -> int:
+        failed = 0
+        with self.app.app_context():
+            started = time.perf_counter()
+            stuck = PaymentModel.find_stuck(datetime.utcnow() - timedelta(seconds=self.processing_timeout))
+            for payment in stuck:
+                if not PaymentModel.fail(payment.id, "Payment processing was interrupted, any charge was refunded. "
+                                                     "Please try again."):
+                    continue
+                db.session.commit()
+                failed += 1
+                try:
+                    self.gateway.refund(amount=payment.amount, token=payment.token, currency=payment.currency)
+                except Exception:
+                    self.app.logger.exception("Failed to refund stuck payment %s", payment.id)
+            db.session.rollback()
+            if failed:
+                self.app.logger.warning("Failed %s payments stuck in processing", failed)
+            metrics.observe_job("payment_reaper", time.perf_counter() - started, failed)
+        return failed
+
+
+payment_processor = PaymentProcessor()
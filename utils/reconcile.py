@@ -0,0 +1,52 @@
+import time
+
+from sqlalchemy import and_, case, func, or_, select
+
+from db import db
+from models.reservation import ReservationModel
+from models.reservation_rollup import ReservationRollupModel
+from models.ticket import TicketModel
+from models.ticket_shard import TicketShardModel
+from utils.cache import cache
+from utils.conts import ticket_numbers
+from utils.sweeper import expiry_sweeper
+
+
+# If the app crashes, the ticket pools may not match the reservations anymore. Expired reservations are released first
+# and then every pool is recomputed as its capacity minus the live (paid or not yet released) reservations, the archived
+# ones included (see ReservationRollupModel), with a single UPDATE that only touches the pools that drifted. The tickets
+# of a sharded pool are in its shards, so what the shards hold is left out of the pool row and the pools fixed that way
+# are split across their shards again
+def reconcile_inventory(batch_size: int) -> dict:
+    started = time.perf_counter()
+    expired = expiry_sweeper.sweep(batch_size)
+
+    live_reservations = select([func.count(ReservationModel.id)]).where(and_(
+        ReservationModel.event_id == TicketModel.event_id,
+        ReservationModel.ticket_type == TicketModel.ticket_type,
+        or_(ReservationModel.paid.is_(True), ReservationModel.released.is_(False)),
+    )).as_scalar()
+    archived_reservations = select([func.coalesce(func.sum(ReservationRollupModel.count), 0)]).where(and_(
+        ReservationRollupModel.event_id == TicketModel.event_id,
+        ReservationRollupModel.ticket_type == TicketModel.ticket_type,
+        or_(ReservationRollupModel.paid.is_(True), ReservationRollupModel.released.is_(False)),
+    )).as_scalar()
+    sharded = select([func.coalesce(func.sum(TicketShardModel.number_available), 0)]).where(
+        TicketShardModel.ticket_id == TicketModel.id
+    ).as_scalar()
+    expected = case(ticket_numbers, value=TicketModel.ticket_type) - live_reservations - archived_reservations - sharded
+    tickets = TicketModel.query.filter(
+        or_(TicketModel.number_available.is_(None), TicketModel.number_available != expected)
+    ).update({TicketModel.number_available: expected, TicketModel.version: TicketModel.version + 1},
+             synchronize_session=False)
+    db.session.commit()
+    pools = db.session.query(TicketModel.event_id, TicketModel.ticket_type, TicketModel.shard_count).filter(
+        TicketModel.shard_count > 0, TicketModel.number_available != 0
+    ).all()
+    for event_id, ticket_type, shard_count in pools:
+        TicketModel.shard(event_id, ticket_type, shard_count)
+    db.session.commit()
+    if tickets:
+        cache.clear()
+
+    return {"expired": expired, "tickets": tickets, "seconds": time.perf_counter() - started}
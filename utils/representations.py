@@ -0,0 +1,61 @@
+"""
+JSON representation of the API responses.
+
+The default flask-restful representation builds a new encoder for every response. With JSON_BACKEND = "json" the
+encoders are built once, the output is byte for byte the same (RESTFUL_JSON settings, indented in debug mode, ending
+with a new line). JSON_BACKEND = "orjson" encodes with orjson (needs the orjson package), which is faster but compact
+(no spaces after the separators, 2 spaces of indentation in debug mode), so the bytes differ.
+"""
+import json
+
+from flask import current_app, make_response
+
+DEFAULT_BACKEND = "json"
+
+
+class JSONRepresentation:
+    def __init__(self):
+        self.backend = DEFAULT_BACKEND
+        self._encoders = {}
+        self._orjson = None
+
+    def init_app(self, app, api) -> None:
+        self.backend = app.config.get("JSON_BACKEND", DEFAULT_BACKEND)
+        self._encoders = {}
+        if self.backend == "orjson":
+            try:
+                import orjson
+            except ImportError:
+                raise RuntimeError("JSON_BACKEND = 'orjson' needs the orjson package to be installed")
+            self._orjson = orjson
+        elif self.backend != "json":
+            raise RuntimeError("Unknown JSON_BACKEND {!r}, it has to be 'json' or 'orjson'".format(self.backend))
+        api.representations["application/json"] = self.output
+
+    # Same settings as flask_restful.representations.json.output_json, one encoder per debug mode
+    def _encoder(self) -> json.JSONEncoder:
+        debug = current_app.debug
+        encoder = self._encoders.get(debug)
+        if encoder is None:
+            settings = dict(current_app.config.get("RESTFUL_JSON", {}))
+            if debug:
+                settings.setdefault("indent", 4)
+                settings.setdefault("sort_keys", False)
+            encoder = self._encoders[debug] = json.JSONEncoder(**settings)
+        return encoder
+
+    def dumps(self, data) -> str:
+        if self._orjson is not None:
+            option = self._orjson.OPT_APPEND_NEWLINE
+            if current_app.debug:
+                option |= self._orjson.OPT_INDENT_2
+            return self._orjson.dumps(data, option=option).decode()
+        return self._encoder().encode(data) + "\n"
+
+    def output(self, data, code, headers=None):
+        response = make_response(self.dumps(data), code)
+        response.headers.extend(headers or {})
+        return response
+
+
+json_representation = JSONRepresentation()
@@ -0,0 +1,79 @@
+"""
+Schema upgrade of an existing database.
+
+db.create_all only creates the tables that are missing, it never changes the existing ones, so a database created by
+an earlier version lacks the columns and indexes added since. upgrade_schema adds them (a NOT NULL column gets its
+default as the value of the existing rows) and fills them from what the old rows already hold. Every step checks the
+current schema first, so it can be run again safely.
+"""
+from sqlalchemy import inspect, literal, text
+
+from db import db
+
+# Columns of the earlier versions the models do not have anymore, dropped once the new columns were filled from them
+DROPPED_COLUMNS = {
+    # replaced by released and computed from expire_at
+    "reservations": ("remaining_time",),
+}
+
+
+# Adds the columns the existing tables lack and backfills them, drops the columns left over by earlier versions, then
+# creates the missing tables and indexes. Returns the changes made (a dropped column starts with -). Committed here
+def upgrade_schema() -> list:
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            added = [column for column in table.columns if column.name not in columns]
+            for column in added:
+                connection.execute(text("ALTER TABLE {} ADD COLUMN {}".format(
+                    table.name, _column_definition(column, engine.dialect))))
+                changes.append("{}.{}".format(table.name, column.name))
+            _backfill(connection, table.name, {column.name for column in added}, columns)
+            for name in DROPPED_COLUMNS.get(table.name, ()):
+                if name in columns and _can_drop_columns(engine.dialect):
+                    connection.execute(text("ALTER TABLE {} DROP COLUMN {}".format(table.name, name)))
+                    changes.append("-{}.{}".format(table.name, name))
+    db.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+                changes.append(index.name)
+    return changes
+
+
+# Fills the columns just added to a table from the columns the old rows have
+def _backfill(connection, table: str, added: set, columns: set) -> None:
+    if table == "reservations" and "released" in added and "remaining_time" in columns:
+        # the expired unpaid reservations were the ones marked in remaining_time
+        connection.execute(text("UPDATE reservations SET released = :released "
+                                "WHERE remaining_time = 'Expired' AND (paid IS NULL OR paid = :paid)"),
+                           released=True, paid=False)
+    if table == "reservations" and "created_at" in added:
+        # reservations were always created 15 minutes before they expire (see ReservationModel), when they were paid
+        # was not kept, so paid_at stays empty for them and the sales time series leave their payments out
+        created_at = "datetime(expire_at, '-15 minutes')" if connection.dialect.name == "sqlite" \
+            else "expire_at - interval '15 minutes'"
+        connection.execute(text("UPDATE reservations SET created_at = {} WHERE created_at IS NULL".format(created_at)))
+
+
+# SQLite can only drop columns since 3.35, before that the old column is left alone (nothing reads or writes it)
+def _can_drop_columns(dialect) -> bool:
+    return dialect.name != "sqlite" or dialect.server_version_info >= (3, 35)
+
+
+def _column_definition(column, dialect) -> str:
+    definition = "{} {}".format(column.name, column.type.compile(dialect=dialect))
+    if not column.nullable:
+        default = literal(column.default.arg, column.type)
+        definition += " NOT NULL DEFAULT {}".format(default.compile(dialect=dialect,
+                                                                    compile_kwargs={"literal_binds": True}))
+    return definition
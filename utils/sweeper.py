@@ -0,0 +1,30 @@
+import time
+
+from models.reservation import ReservationModel
+from utils.admission import admission_gate
+from utils.metrics import metrics
+
+
+class ExpirySweeper:
+    """Releases the tickets of unpaid reservations past their expiration time, in batches of set-based statements,
+    and keeps track of how much work each sweep did"""
+
+    def __init__(self):
+        self.stats = metrics.job_stats("expiry_sweeper")
+
+    def sweep(self, batch_size: int) -> int:
+        started = time.perf_counter()
+        processed = 0
+        while True:
+            expired = ReservationModel.expire_batch(batch_size)
+            processed += expired
+            if expired < batch_size:
+                break
+        if processed:
+            # the released tickets can be sold again
+            admission_gate.reopen()
+        self.stats.record(processed, time.perf_counter() - started)
+        return processed
+
+
+expiry_sweeper = ExpirySweeper()
@@ -0,0 +1,80 @@
+"""
+Sales velocity of an event: reservations, payments and expiries per time bucket and ticket type.
+
+Every series is counted by the database, grouped on one timestamp of the reservations rounded down to the bucket
+width (reservations on created_at, payments on paid_at and expiries on the expire_at of the unpaid ones), over the
+range of the (event_id, timestamp) index. A bucket is closed once it ended TIMESERIES_CLOSE_DELAY seconds ago, enough
+for the transactions that stamped a time in it to commit. Closed buckets do not change anymore and are cached for
+TIMESERIES_CACHE_TTL seconds, so a dashboard polling the same range only has the open buckets computed again.
+"""
+import calendar
+from datetime import datetime
+
+from models.reservation import ReservationModel
+from models.reservation_archive import ReservationArchiveModel
+from utils.cache import cache, timeseries_key
+from utils.conts import ticket_types
+
+SERIES = ("reservations", "payments", "expiries")
+
+
+# Naive timestamps are taken as UTC both ways, like the database does when it buckets them (see epoch_bucket)
+def to_epoch(moment: datetime) -> int:
+    return calendar.timegm(moment.timetuple())
+
+
+def from_epoch(seconds: int) -> datetime:
+    return datetime.utcfromtimestamp(seconds)
+
+
+def empty_bucket() -> dict:
+    return {series: {ticket_type: 0 for ticket_type in ticket_types} for series in SERIES}
+
+
+# Counts of every bucket of [start, end) by bucket start, a query per series
+def count_buckets(event_id: int, start: int, end: int, width: int) -> dict:
+    now = datetime.now()
+    start, end = from_epoch(start), from_epoch(end)
+    buckets = {}
+    # the reservations archived since are counted the same way
+    for model in (ReservationModel, ReservationArchiveModel):
+        counts = {
+            "reservations": model.count_by_bucket(event_id, "created_at", start, end, width),
+            "payments": model.count_by_bucket(event_id, "paid_at", start, end, width, model.paid.is_(True)),
+            # a reservation only counts as expired once its expiration time passed
+            "expiries": model.count_by_bucket(event_id, "expire_at", start, min(end, now), width,
+                                              model.paid.is_(False)),
+        }
+        for series, rows in counts.items():
+            for bucket, ticket_type, count in rows:
+                buckets.setdefault(int(bucket), empty_bucket())[series][ticket_type] += count
+    return buckets
+
+
+# Buckets of width seconds between start and end (rounded out to whole buckets), as a list of
+# {"start": datetime, "reservations": {ticket_type: count}, "payments": {...}, "expiries": {...}}
+def sales_timeseries(event_id: int, start: datetime, end: datetime, width: int, close_delay: float,
+                     cache_ttl: float) -> list:
+    first = to_epoch(start) // width * width
+    last = -(-to_epoch(end) // width) * width
+    closed_before = to_epoch(datetime.now()) - close_delay
+    starts = list(range(first, last, width))
+
+    buckets = {}
+    for bucket in starts:
+        if bucket + width > closed_before:
+            break
+        cached = cache.get(timeseries_key(event_id, width, bucket))
+        if cached is None:
+            break
+        buckets[bucket] = cached
+
+    # everything from the first bucket that is open or not cached is counted again
+    missing = starts[len(buckets):]
+    if missing:
+        counted = count_buckets(event_id, missing[0], last, width)
+        for bucket in missing:
+            buckets[bucket] = counted.get(bucket) or empty_bucket()
+            if bucket + width <= closed_before:
+                cache.set(timeseries_key(event_id, width, bucket), buckets[bucket], cache_ttl)
+    return [dict(buckets[bucket], start=from_epoch(bucket)) for bucket in starts]
@@ -0,0 +1,26 @@
+"""
+Request scoped unit of work.
+
+Model methods only stage their changes (save_to_db / delete_from_db add and flush, they never commit). A request that
+changes data is committed once after its handler succeeded, a failed one (4xx/5xx or an exception) is rolled back, and
+read only requests (GET, HEAD, OPTIONS) never commit. Code running outside of a request (CLI commands, background
+jobs) commits on its own.
+"""
+from flask import request
+
+READ_ONLY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def init_app(app, session) -> None:
+    @app.after_request
+    def commit_request(response):
+        if request.method in READ_ONLY_METHODS or response.status_code >= 400:
+            session.rollback()
+        else:
+            session.commit()
+        return response
+
+    @app.teardown_request
+    def rollback_request(exception):
+        if exception is not None:
+            session.rollback()
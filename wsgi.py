@@ -0,0 +1,20 @@
+"""
+Entry point for uWSGI (see uwsgi.ini).
+
+Only the app is created in the master, the database is left alone: several masters may start at once (one per
+instance), so the tables and the reconciliation of the ticket pools are a deploy step run once before them
+(FLASK_APP=app.py flask reconcile). Each worker starts its scheduler after the fork, and only the one holding the
+background lease runs the jobs.
+"""
+from app import create_app
+from utils.background import background
+
+app = create_app()
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    # not running under uWSGI
+    background.start()
+else:
+    postfork(background.start)